@@ -0,0 +1,249 @@
+"""
+Indexed BlueZ device lookup shared by the BLE tools.
+
+Bleak's BlueZ manager mirrors GetManagedObjects in `_properties` and keeps it in
+sync via ObjectManager InterfacesAdded/InterfacesRemoved signals. Walking that dict
+for every lookup is O(objects) (adapters, devices, services, characteristics ...),
+which gets slow on crowded adapters. Instead we seed an address index once per
+manager and keep it current from the same signals, so a lookup is a dict hit.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from bleak.backends.device import BLEDevice
+from bleak.backends.bluezdbus.manager import get_global_bluez_manager
+
+_DEVICE_IFACE = "org.bluez.Device1"
+_OBJECT_MANAGER_IFACE = "org.freedesktop.DBus.ObjectManager"
+
+# address (upper case) -> {object path -> Device1 properties}
+# One address can be known under several adapters (hci0 + hci1), hence the inner dict.
+_ADDR_INDEX: Dict[str, Dict[str, Dict[str, Any]]] = {}
+_INDEX_READY = False
+_INDEX_MGR: Any = None
+
+# (address, adapter) -> (resolved at, BLEDevice); lets repeated lookups skip the manager
+# round trip entirely. Entries die after DEV_CACHE_TTL_S or when BlueZ removes the device.
+DEV_CACHE_TTL_S = 60.0
+_DEV_CACHE: Dict[Tuple[str, Optional[str]], Tuple[float, BLEDevice]] = {}
+
+
+def _addr_of(dev1: Dict[str, Any]) -> str:
+    return str(dev1.get("Address") or "").strip().upper()
+
+
+def _index_add(path: str, dev1: Dict[str, Any]) -> None:
+    addr = _addr_of(dev1)
+    if addr:
+        _ADDR_INDEX.setdefault(addr, {})[str(path)] = dev1
+
+
+def _index_remove(path: str) -> None:
+    path = str(path)
+    for addr, paths in list(_ADDR_INDEX.items()):
+        if paths.pop(path, None) is not None:
+            for key in [k for k in _DEV_CACHE if k[0] == addr]:
+                del _DEV_CACHE[key]
+            if not paths:
+                del _ADDR_INDEX[addr]
+
+
+def _seed_index(props: Dict[str, Any]) -> None:
+    _ADDR_INDEX.clear()
+    _DEV_CACHE.clear()
+    for path, ifaces in props.items():
+        try:
+            dev1 = (ifaces or {}).get(_DEVICE_IFACE)
+            if dev1:
+                _index_add(path, dev1)
+        except Exception:
+            continue
+
+
+def _make_signal_handler(mgr: Any):
+    # Must always return None: a truthy return would stop dbus-fast from
+    # dispatching the message to bleak's own handler.
+    def handler(msg: Any) -> None:
+        try:
+            if getattr(msg, "interface", None) != _OBJECT_MANAGER_IFACE:
+                return
+            member = getattr(msg, "member", None)
+            if member == "InterfacesAdded":
+                path, ifaces = msg.body[0], msg.body[1]
+                if _DEVICE_IFACE not in (ifaces or {}):
+                    return
+                # Prefer bleak's (variant-unpacked) copy; it is updated in place on PropertiesChanged.
+                dev1 = ((getattr(mgr, "_properties", {}) or {}).get(path) or {}).get(_DEVICE_IFACE)
+                if dev1 is None:
+                    dev1 = {k: getattr(v, "value", v) for k, v in ifaces[_DEVICE_IFACE].items()}
+                _index_add(path, dev1)
+            elif member == "InterfacesRemoved":
+                path, ifaces = msg.body[0], msg.body[1]
+                if _DEVICE_IFACE in (ifaces or []):
+                    _index_remove(path)
+        except Exception:
+            return
+
+    return handler
+
+
+async def ensure_index() -> bool:
+    """
+    Make sure the address index exists for the current event loop's BlueZ manager.
+    Long-running processes call this once at startup so the first poll does not pay for it.
+    """
+    global _INDEX_READY, _INDEX_MGR
+    try:
+        mgr = await get_global_bluez_manager()
+        await mgr.async_init()
+    except Exception:
+        return False
+
+    # bleak keeps one manager per event loop; rebuild if we are on a new one.
+    if _INDEX_READY and mgr is _INDEX_MGR:
+        return True
+
+    try:
+        _seed_index(getattr(mgr, "_properties", {}) or {})
+    except Exception:
+        return False
+    try:
+        mgr._bus.add_message_handler(_make_signal_handler(mgr))
+    except Exception:
+        # No signal subscription: reseed on every lookup instead of serving a stale index.
+        return True
+    _INDEX_MGR = mgr
+    _INDEX_READY = True
+    return True
+
+
+async def ble_device_from_bluez_cache(address: str, adapter: Optional[str]) -> Optional[BLEDevice]:
+    """
+    Resolve a BLEDevice from BlueZ's object cache (no scan).
+    Many BLE modules stop advertising when connected/busy, so scanning is the fallback only.
+    """
+    want = (address or "").strip().upper()
+    if not want:
+        return None
+    key = (want, (str(adapter).strip() or None) if adapter else None)
+    cached = _DEV_CACHE.get(key)
+    if cached is not None and time.monotonic() - cached[0] < DEV_CACHE_TTL_S:
+        return cached[1]
+    if not await ensure_index():
+        return None
+
+    adapter_prefix = None
+    if adapter:
+        a = str(adapter).strip()
+        if a:
+            adapter_prefix = f"/org/bluez/{a}/"
+
+    hit = _ADDR_INDEX.get(want)
+    if not hit:
+        return None
+    for path, dev1 in hit.items():
+        if adapter_prefix and not path.startswith(adapter_prefix):
+            continue
+        name = dev1.get("Name") or dev1.get("Alias") or None
+        dev = BLEDevice(address=want, name=name, details={"path": path, "props": dev1})
+        _DEV_CACHE[key] = (time.monotonic(), dev)
+        return dev
+    return None
+
+
+# Device1.ConnectionParameters (min_interval, max_interval, latency, supervision timeout),
+# intervals in 1.25 ms units, timeout in 10 ms units: 7.5-15 ms, no slave latency, 2 s.
+FAST_CONN_PARAMS = (6, 12, 0, 200)
+
+
+_DEBUGFS_BT = "/sys/kernel/debug/bluetooth"
+
+
+def set_debugfs_conn_interval(adapter: Optional[str], min_interval: int, max_interval: int) -> Optional[Tuple[int, int]]:
+    """
+    Set the adapter's connection interval for new connections via debugfs (1.25 ms units).
+    Needs root and a mounted debugfs. Returns the previous (min, max) for restoring,
+    or None if the files could not be read or written (a half-done change is undone).
+    """
+    base = f"{_DEBUGFS_BT}/{(adapter or '').strip() or 'hci0'}"
+    try:
+        with open(f"{base}/conn_min_interval") as f:
+            old_min = int(f.read().strip())
+        with open(f"{base}/conn_max_interval") as f:
+            old_max = int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+    old = {"conn_min_interval": old_min, "conn_max_interval": old_max}
+    # the kernel rejects min > max, so write in the order that never crosses
+    order = [("conn_min_interval", min_interval), ("conn_max_interval", max_interval)]
+    if min_interval > old_max:
+        order.reverse()
+    written = []
+    try:
+        for name, value in order:
+            with open(f"{base}/{name}", "w") as f:
+                f.write(str(int(value)))
+            written.append(name)
+    except (OSError, ValueError):
+        # put back what was already changed, newest first (again never crossing min/max)
+        for name in reversed(written):
+            try:
+                with open(f"{base}/{name}", "w") as f:
+                    f.write(str(old[name]))
+            except OSError:
+                pass
+        return None
+    return old_min, old_max
+
+
+async def request_fast_connection(client: Any, params: tuple = FAST_CONN_PARAMS) -> bool:
+    """
+    Ask BlueZ for a short connection interval on a connected BleakClient.
+    Request/response protocols pay one interval per round trip, so this cuts read latency.
+    Not every BlueZ build exposes the property: any failure is ignored (returns False).
+    The parameters belong to the link, a reconnect starts from the defaults again.
+    """
+    try:
+        from dbus_fast import Message, MessageType, Variant
+
+        backend = client._backend
+        reply = await backend._bus.call(
+            Message(
+                destination="org.bluez",
+                path=backend._device_path,
+                interface="org.freedesktop.DBus.Properties",
+                member="Set",
+                signature="ssv",
+                body=[_DEVICE_IFACE, "ConnectionParameters", Variant("(qqqq)", list(params))],
+            )
+        )
+        return reply is not None and reply.message_type != MessageType.ERROR
+    except Exception:
+        return False
+
+
+async def with_ble_lock(fn, *, timeout_s: float = 30.0):
+    """
+    Serialize BLE operations across multiple processes (JK/DALY gateways, JK writer).
+    BlueZ can fail with InProgress/Notify acquired when two processes use the same adapter.
+    `fn` is an async callable; waiting for the lock does not block the event loop.
+    """
+    import fcntl
+
+    lock_path = os.environ.get("BMS_BLE_LOCK_PATH", "/tmp/bms_ble.lock")
+    deadline = time.time() + float(timeout_s)
+    with open(lock_path, "w", encoding="utf-8") as f:
+        while True:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.time() >= deadline:
+                    raise TimeoutError("BLE lock timeout")
+                await asyncio.sleep(0.1)
+        return await fn()
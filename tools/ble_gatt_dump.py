@@ -1,45 +1,21 @@
 #!/usr/bin/env python3
 import argparse
 import asyncio
-from typing import Any, Optional
+import sys
+from typing import Any
 from bleak import BleakClient
 from bleak import BleakScanner
-from bleak.backends.device import BLEDevice
-from bleak.backends.bluezdbus.manager import get_global_bluez_manager
 
+from _ble_cache import ble_device_from_bluez_cache
 
-async def _ble_device_from_bluez_cache(address: str, adapter: Optional[str]) -> Optional[BLEDevice]:
-    try:
-        mgr = await get_global_bluez_manager()
-        await mgr.async_init()
-        props = getattr(mgr, "_properties", {}) or {}
-    except Exception:
-        return None
 
-    want = (address or "").strip().upper()
-    if not want:
+def _handle(obj: Any):
+    # 'handle' is not always available on every backend/version; keep output portable.
+    try:
+        return obj.handle
+    except AttributeError:
         return None
 
-    adapter_prefix = None
-    if adapter:
-        a = str(adapter).strip()
-        if a:
-            adapter_prefix = f"/org/bluez/{a}/"
-
-    for path, ifaces in props.items():
-        try:
-            dev1 = (ifaces or {}).get("org.bluez.Device1") or {}
-            addr = str(dev1.get("Address") or "").strip().upper()
-            if addr != want:
-                continue
-            if adapter_prefix and not str(path).startswith(adapter_prefix):
-                continue
-            name = dev1.get("Name") or dev1.get("Alias") or None
-            return BLEDevice(address=want, name=name, details={"path": path, "props": dev1})
-        except Exception:
-            continue
-    return None
-
 
 async def main():
     ap = argparse.ArgumentParser(description="Dump BLE GATT services/characteristics for a device.")
@@ -49,7 +25,7 @@ async def main():
     ap.add_argument("--scan-timeout", type=float, default=10.0, help="Scan time if not in BlueZ cache")
     args = ap.parse_args()
 
-    dev = await _ble_device_from_bluez_cache(args.address, args.adapter)
+    dev = await ble_device_from_bluez_cache(args.address, args.adapter)
     if dev is None and args.scan_timeout > 0:
         try:
             dev = await BleakScanner.find_device_by_address(
@@ -62,20 +38,26 @@ async def main():
 
     async with BleakClient(client_arg, timeout=args.timeout, adapter=args.adapter) as client:
         svcs = client.services
-        print(f"connected={client.is_connected} address={args.address} adapter={args.adapter}")
+        lines = [f"connected={client.is_connected} address={args.address} adapter={args.adapter}"]
+        add = lines.append
+        # most characteristics share a handful of property combinations
+        props_txt: dict[tuple, str] = {}
         for s in svcs:
             # Bleak's BlueZ backend doesn't expose stable start/end handles across versions.
-            print(f"\n[SVC] {s.uuid}")
+            add(f"\n[SVC] {s.uuid}")
             for c in s.characteristics:
-                props = ",".join(sorted(c.properties))
-                # 'handle' is not always available on every backend/version; keep output portable.
-                h = getattr(c, "handle", None)
+                key = tuple(c.properties)
+                props = props_txt.get(key)
+                if props is None:
+                    props = props_txt[key] = ",".join(sorted(key))
+                h = _handle(c)
                 htxt = f" handle={h}" if h is not None else ""
-                print(f"  [CHR] {c.uuid}{htxt}  props={props}")
+                add(f"  [CHR] {c.uuid}{htxt}  props={props}")
                 for d in c.descriptors:
-                    dh = getattr(d, "handle", None)
+                    dh = _handle(d)
                     dhtxt = f" handle={dh}" if dh is not None else ""
-                    print(f"    [DSC] {d.uuid}{dhtxt}")
+                    add(f"    [DSC] {d.uuid}{dhtxt}")
+        sys.stdout.write("\n".join(lines) + "\n")
 
 
 if __name__ == "__main__":
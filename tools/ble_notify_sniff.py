@@ -3,7 +3,7 @@
 BLE notification sniffer (BlueZ/bleak).
 
 Connects to a BLE device, enables notifications on all characteristics that support notify/indicate,
-and prints received payloads as JSON lines:
+and writes received payloads as JSON lines (stdout is flushed about once per second):
   {"ts":..., "char_uuid":"...", "kind":"notify", "hex":"..."}
 
 Useful to reverse engineer devices (e.g. DALY active balancer modules) before implementing a decoder.
@@ -11,13 +11,28 @@ Useful to reverse engineer devices (e.g. DALY active balancer modules) before im
 
 import argparse
 import asyncio
+import collections
 import json
+import sys
 import time
-from typing import Any, Optional
+from typing import Any
 
 from bleak import BleakClient, BleakScanner
-from bleak.backends.device import BLEDevice
-from bleak.backends.bluezdbus.manager import get_global_bluez_manager
+
+from _ble_cache import ble_device_from_bluez_cache
+
+try:
+    import orjson
+except ImportError:  # optional, stdlib json as fallback
+    orjson = None
+
+# Notify callbacks only append raw tuples here; _drain() serializes and writes them
+# so JSON encoding and stdout I/O never run inside the BlueZ callback.
+_Q: "collections.deque[tuple[float, str, bytes]]" = collections.deque(maxlen=8192)
+_OUT = sys.stdout.buffer
+
+# first 8 hex digits of 16-bit-based service UUIDs commonly used by BMS modules
+_BMS_SERVICE_PREFIXES = ("0000ffe0", "0000fff0")
 
 
 def _now() -> float:
@@ -27,37 +42,37 @@ def _now() -> float:
 def _hex(b: bytearray | bytes) -> str:
     return bytes(b).hex()
 
-async def _ble_device_from_bluez_cache(address: str, adapter: Optional[str]) -> Optional[BLEDevice]:
-    try:
-        mgr = await get_global_bluez_manager()
-        await mgr.async_init()
-        props = getattr(mgr, "_properties", {}) or {}
-    except Exception:
-        return None
-
-    want = (address or "").strip().upper()
-    if not want:
-        return None
-
-    adapter_prefix = None
-    if adapter:
-        a = str(adapter).strip()
-        if a:
-            adapter_prefix = f"/org/bluez/{a}/"
-
-    for path, ifaces in props.items():
-        try:
-            dev1 = (ifaces or {}).get("org.bluez.Device1") or {}
-            addr = str(dev1.get("Address") or "").strip().upper()
-            if addr != want:
-                continue
-            if adapter_prefix and not str(path).startswith(adapter_prefix):
-                continue
-            name = dev1.get("Name") or dev1.get("Alias") or None
-            return BLEDevice(address=want, name=name, details={"path": path, "props": dev1})
-        except Exception:
-            continue
-    return None
+
+def _dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def _emit(obj: Any) -> None:
+    # Bypass the text layer; _drain() flushes periodically instead of per line.
+    _OUT.write(_dumps(obj))
+    _OUT.write(b"\n")
+
+
+def _flush_notifies() -> None:
+    write = _OUT.write
+    while _Q:
+        ts, uuid, data = _Q.popleft()
+        write(_dumps({"ts": ts, "char_uuid": uuid, "kind": "notify", "hex": data.hex()}))
+        write(b"\n")
+
+
+async def _drain(stop: asyncio.Event, interval_s: float = 0.02, flush_s: float = 1.0) -> None:
+    t_flush = _now() + flush_s
+    while not stop.is_set():
+        _flush_notifies()
+        if _now() >= t_flush:
+            _OUT.flush()
+            t_flush = _now() + flush_s
+        await asyncio.sleep(interval_s)
+    _flush_notifies()
+    _OUT.flush()
 
 
 async def main() -> int:
@@ -92,9 +107,29 @@ async def main() -> int:
         action="store_true",
         help="Use write-with-response (default is without response)",
     )
+    ap.add_argument(
+        "--max-notify",
+        type=int,
+        default=64,
+        help="Enable notifications on at most N characteristics (likely BMS UART channels first)",
+    )
     args = ap.parse_args()
 
-    dev = await _ble_device_from_bluez_cache(args.address, args.adapter)
+    # Parse write payloads once; do_writes() only replays them.
+    # Each entry: (payload, its hex as bytes for the preformatted write_ok line)
+    write_payloads: list[tuple[bytes, bytes]] = []
+    for hx in (args.write_hex or []):
+        try:
+            pld = bytes.fromhex(hx.strip().replace(" ", ""))
+        except ValueError:
+            _emit({"ts": _now(), "kind": "write_payload_error", "error": f"bad hex: {hx}"})
+            continue
+        write_payloads.append((pld, pld.hex().encode("ascii")))
+    for tx in (args.write_text or []):
+        pld = str(tx).encode("utf-8")
+        write_payloads.append((pld, pld.hex().encode("ascii")))
+
+    dev = await ble_device_from_bluez_cache(args.address, args.adapter)
     if dev is None and args.scan_timeout > 0:
         try:
             # bleak 2.x: adapter passed as kwarg; safe for older versions too
@@ -108,121 +143,150 @@ async def main() -> int:
 
     async with BleakClient(client_arg, timeout=args.timeout, adapter=args.adapter) as client:
         out = {"ts": _now(), "connected": bool(client.is_connected), "address": args.address, "adapter": args.adapter}
-        print(json.dumps(out, ensure_ascii=False))
+        _emit(out)
+        _OUT.flush()
+
+        # one pass over the GATT table; everything below works on these lists
+        read_uuids: list[str] = []
+        notify_uuids: list[str] = []
+        notify_score: dict[str, int] = {}
+        for svc in client.services:
+            # DALY (fff0) and JK (ffe0) put their UART-style channels in these services
+            bms_svc = str(svc.uuid).lower()[:8] in _BMS_SERVICE_PREFIXES
+            for ch in svc.characteristics:
+                p = ch.properties or ()
+                if "read" in p:
+                    read_uuids.append(ch.uuid)
+                if "notify" in p or "indicate" in p:
+                    notify_uuids.append(ch.uuid)
+                    # notify + write-without-response on one char is the typical BMS frame pipe
+                    notify_score[ch.uuid] = (10 if "write-without-response" in p else 0) + (5 if bms_svc else 0)
+
+        # Every StartNotify is a D-Bus round trip (and possibly an AcquireNotify fd):
+        # subscribe the likely data channels first and stop at --max-notify.
+        # sorted() is stable, so equal scores keep GATT table order.
+        notify_uuids.sort(key=lambda u: notify_score[u], reverse=True)
+        max_notify = max(0, int(args.max_notify))
+        if len(notify_uuids) > max_notify:
+            _emit({"ts": _now(), "kind": "notify_skipped", "char_uuids": notify_uuids[max_notify:]})
+            del notify_uuids[max_notify:]
 
         # snapshot readable characteristics (best-effort)
+        async def read_retry(u: str) -> bytearray:
+            try:
+                return await client.read_gatt_char(u)
+            except Exception:
+                # BlueZ occasionally rejects a read with InProgress; one retry is enough
+                await asyncio.sleep(0.1)
+                return await client.read_gatt_char(u)
+
         try:
-            reads = []
-            for svc in client.services:
-                for ch in svc.characteristics:
-                    if "read" in (ch.properties or []):
-                        reads.append(ch.uuid)
             # limit: only first N reads to keep connect time short
-            reads = reads[:30]
-            for u in reads:
-                try:
-                    v = await client.read_gatt_char(u)
-                    print(json.dumps({"ts": _now(), "char_uuid": u, "kind": "read", "hex": _hex(v)}, ensure_ascii=False))
-                except Exception as e:
-                    print(
-                        json.dumps({"ts": _now(), "char_uuid": u, "kind": "read_error", "error": str(e)}, ensure_ascii=False)
-                    )
+            reads = read_uuids[:30]
+            # Issue all reads at once: BlueZ queues them per adapter, but we no longer
+            # wait one round trip per characteristic before enabling notifications.
+            try:
+                results = await asyncio.wait_for(
+                    asyncio.gather(*(read_retry(u) for u in reads), return_exceptions=True),
+                    timeout=float(args.timeout),
+                )
+            except asyncio.TimeoutError:
+                results = [TimeoutError("read snapshot timed out")] * len(reads)
+            for u, v in zip(reads, results):
+                if isinstance(v, BaseException):
+                    _emit({"ts": _now(), "char_uuid": u, "kind": "read_error", "error": str(v)})
+                else:
+                    _emit({"ts": _now(), "char_uuid": u, "kind": "read", "hex": _hex(v)})
         except Exception:
             pass
 
         # enable notifications
-        enabled = 0
-
         def mk_cb(uuid: str):
             def cb(_: int, data: bytearray):
-                print(
-                    json.dumps(
-                        {"ts": _now(), "char_uuid": uuid, "kind": "notify", "hex": _hex(data)},
-                        ensure_ascii=False,
-                    )
-                )
+                _Q.append((_now(), uuid, bytes(data)))
 
             return cb
 
-        for svc in client.services:
-            for ch in svc.characteristics:
-                props = set(ch.properties or [])
-                if "notify" in props or "indicate" in props:
-                    try:
-                        await client.start_notify(ch.uuid, mk_cb(ch.uuid))
-                        enabled += 1
-                        print(json.dumps({"ts": _now(), "char_uuid": ch.uuid, "kind": "notify_enabled"}, ensure_ascii=False))
-                    except Exception as e:
-                        print(
-                            json.dumps(
-                                {"ts": _now(), "char_uuid": ch.uuid, "kind": "notify_enable_error", "error": str(e)},
-                                ensure_ascii=False,
-                            )
-                        )
+        enabled_uuids: list[str] = []
+        start_notify = client.start_notify
+        for u in notify_uuids:
+            try:
+                await start_notify(u, mk_cb(u))
+                enabled_uuids.append(u)
+                _emit({"ts": _now(), "char_uuid": u, "kind": "notify_enabled"})
+            except Exception as e:
+                _emit({"ts": _now(), "char_uuid": u, "kind": "notify_enable_error", "error": str(e)})
+        enabled = len(enabled_uuids)
 
         async def do_writes() -> None:
-            if not args.write_uuid:
-                return
-            payloads: list[bytes] = []
-            for hx in (args.write_hex or []):
-                try:
-                    payloads.append(bytes.fromhex(hx.strip().replace(" ", "")))
-                except Exception:
-                    print(
-                        json.dumps(
-                            {"ts": _now(), "kind": "write_payload_error", "error": f"bad hex: {hx}"},
-                            ensure_ascii=False,
-                        )
-                    )
-            for tx in (args.write_text or []):
-                try:
-                    payloads.append(str(tx).encode("utf-8"))
-                except Exception:
-                    pass
-            if not payloads:
+            if not args.write_uuid or not write_payloads:
                 return
+            uuid = args.write_uuid
+            response = bool(args.write_response)
+            write = client.write_gatt_char
+            # write_ok is the per-write log line; skip json.dumps and fill a template instead
+            ok_tpl = b'{"ts":%a,"kind":"write_ok","char_uuid":' + json.dumps(uuid).encode("utf-8") + b',"hex":"%b"}\n'
+
+            loop = asyncio.get_running_loop()
+            interval = max(0.05, float(args.write_interval))
+            # cycles start on a fixed grid, the time spent writing does not stretch the interval
+            deadline = loop.time()
 
             # repeat sequence
             for i in range(max(1, int(args.write_count))):
-                for pld in payloads:
-                    try:
-                        await client.write_gatt_char(args.write_uuid, pld, response=bool(args.write_response))
-                        print(
-                            json.dumps(
-                                {"ts": _now(), "kind": "write_ok", "char_uuid": args.write_uuid, "hex": pld.hex()},
-                                ensure_ascii=False,
-                            )
-                        )
-                    except Exception as e:
-                        print(
-                            json.dumps(
-                                {"ts": _now(), "kind": "write_error", "char_uuid": args.write_uuid, "error": str(e)},
-                                ensure_ascii=False,
-                            )
-                        )
-                await asyncio.sleep(max(0.05, float(args.write_interval)))
+                if response:
+                    # with response BlueZ completes one ATT request at a time anyway
+                    for pld, pld_hex in write_payloads:
+                        try:
+                            await write(uuid, pld, response=True)
+                            _OUT.write(ok_tpl % (_now(), pld_hex))
+                        except Exception as e:
+                            _emit({"ts": _now(), "kind": "write_error", "char_uuid": uuid, "error": str(e)})
+                else:
+                    # Write commands are queued locally by BlueZ: send the whole sequence as one
+                    # burst. Tasks start in order, so the D-Bus calls go out in payload order.
+                    results = await asyncio.gather(
+                        *(write(uuid, pld, response=False) for pld, _ in write_payloads),
+                        return_exceptions=True,
+                    )
+                    ts = _now()
+                    for (_, pld_hex), r in zip(write_payloads, results):
+                        if isinstance(r, BaseException):
+                            _emit({"ts": ts, "kind": "write_error", "char_uuid": uuid, "error": str(r)})
+                        else:
+                            _OUT.write(ok_tpl % (ts, pld_hex))
+                deadline += interval
+                await asyncio.sleep(max(0.0, deadline - loop.time()))
+
+        drain_stop = asyncio.Event()
+        drain = asyncio.create_task(_drain(drain_stop))
 
         # kick off optional writes in background while sniffing
         wt = asyncio.create_task(do_writes())
 
-        # wait/sniff
-        await asyncio.sleep(max(0.1, args.duration))
         try:
-            await wt
-        except Exception:
-            pass
+            # wait/sniff
+            await asyncio.sleep(max(0.1, args.duration))
+            try:
+                await wt
+            except Exception:
+                pass
 
-        # stop notifications
-        for svc in client.services:
-            for ch in svc.characteristics:
-                props = set(ch.properties or [])
-                if "notify" in props or "indicate" in props:
-                    try:
-                        await client.stop_notify(ch.uuid)
-                    except Exception:
-                        pass
-
-        print(json.dumps({"ts": _now(), "kind": "done", "notify_enabled": enabled}, ensure_ascii=False))
+            # stop notifications
+            for u in enabled_uuids:
+                try:
+                    await client.stop_notify(u)
+                except Exception:
+                    pass
+        finally:
+            # also on Ctrl-C: write out what is still queued and the done line
+            wt.cancel()
+            drain_stop.set()
+            await drain
+            _emit({"ts": _now(), "kind": "done", "notify_enabled": enabled})
+            # notifies that arrived after the drain task stopped
+            _flush_notifies()
+            _OUT.flush()
         return 0
 
 
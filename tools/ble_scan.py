@@ -11,40 +11,53 @@ async def main():
     ap.add_argument("--verbose", action="store_true", help="print extra advertisement metadata")
     args = ap.parse_args()
 
-    seen = {}  # addr -> dict(name, rssi)
+    # Struct-of-arrays store: addr -> row index, one list per field.
+    # The callback runs for every advertisement, so first sight appends one row and
+    # later sightings only touch the fields that can still improve.
+    idx: dict[str, int] = {}
+    addrs: list[str] = []
+    names: list[str] = []
+    rssis: list = []
+    connectables: list = []
+    uuids_l: list[list[str]] = []
+    mfgs: list[dict] = []
+    svcs: list[dict] = []
 
     def cb(device, adv):
         addr = device.address
         name = (device.name or adv.local_name or "").strip()
         rssi = getattr(adv, "rssi", None)
         connectable = getattr(adv, "connectable", None)
-        uuids = list(getattr(adv, "service_uuids", []) or [])
-        mfg = dict(getattr(adv, "manufacturer_data", {}) or {})
-        svc_data = dict(getattr(adv, "service_data", {}) or {})
-        cur = seen.get(addr)
-        if cur is None:
-            seen[addr] = {
-                "name": name,
-                "rssi": rssi,
-                "connectable": connectable,
-                "uuids": uuids,
-                "mfg": mfg,
-                "svc_data": svc_data,
-            }
+        i = idx.get(addr)
+        if i is None:
+            idx[addr] = len(addrs)
+            addrs.append(addr)
+            names.append(name)
+            rssis.append(rssi)
+            connectables.append(connectable)
+            uuids_l.append(list(getattr(adv, "service_uuids", []) or []))
+            mfgs.append(dict(getattr(adv, "manufacturer_data", {}) or {}))
+            svcs.append(dict(getattr(adv, "service_data", {}) or {}))
             return
         # Keep strongest RSSI and non-empty name
-        if rssi is not None and (cur["rssi"] is None or rssi > cur["rssi"]):
-            cur["rssi"] = rssi
-        if name and not cur["name"]:
-            cur["name"] = name
+        if rssi is not None and (rssis[i] is None or rssi > rssis[i]):
+            rssis[i] = rssi
+        if name and not names[i]:
+            names[i] = name
         if connectable is not None:
-            cur["connectable"] = connectable
-        if uuids and not cur["uuids"]:
-            cur["uuids"] = uuids
-        if mfg and not cur["mfg"]:
-            cur["mfg"] = mfg
-        if svc_data and not cur["svc_data"]:
-            cur["svc_data"] = svc_data
+            connectables[i] = connectable
+        if not uuids_l[i]:
+            uuids = getattr(adv, "service_uuids", None)
+            if uuids:
+                uuids_l[i] = list(uuids)
+        if not mfgs[i]:
+            mfg = getattr(adv, "manufacturer_data", None)
+            if mfg:
+                mfgs[i] = dict(mfg)
+        if not svcs[i]:
+            svc_data = getattr(adv, "service_data", None)
+            if svc_data:
+                svcs[i] = dict(svc_data)
 
     # Bleak's adapter kwarg exists on most Linux/BlueZ builds, but keep a fallback
     # to stay compatible with older versions.
@@ -56,27 +69,26 @@ async def main():
     await asyncio.sleep(args.timeout)
     await scanner.stop()
 
-    def sort_key(item):
-        rssi = item[1]["rssi"]
-        return rssi if rssi is not None else -9999
+    order = sorted(range(len(addrs)), key=lambda i: rssis[i] if rssis[i] is not None else -9999, reverse=True)
 
-    for addr, meta in sorted(seen.items(), key=sort_key, reverse=True):
+    for i in order:
+        addr = addrs[i]
         if not args.verbose:
-            print(f"{addr}\t{meta['rssi']}\t{meta['name']}")
+            print(f"{addr}\t{rssis[i]}\t{names[i]}")
             continue
 
         # compact manufacturer data preview
         mfg_preview = ""
-        if meta["mfg"]:
+        if mfgs[i]:
             parts = []
-            for k, v in meta["mfg"].items():
+            for k, v in mfgs[i].items():
                 b = bytes(v)
                 parts.append(f"{k:04X}:{b[:8].hex()}")
             mfg_preview = ",".join(parts)
 
-        uu = ",".join(meta["uuids"][:6])  # keep compact
+        uu = ",".join(uuids_l[i][:6])  # keep compact
         print(
-            f"{addr}\t{meta['rssi']}\tconn={meta['connectable']}\tname={meta['name']}\tuuids={uu}\tmfg={mfg_preview}"
+            f"{addr}\t{rssis[i]}\tconn={connectables[i]}\tname={names[i]}\tuuids={uu}\tmfg={mfg_preview}"
         )
 
 
@@ -6,11 +6,14 @@ Publishes one JSON payload per poll cycle to:
   {base_topic}/daly/<name>/raw
   {base_topic}/daly/<name>/online   ("true"/"false", retained)
   {base_topic}/daly/<name>/meta    (small JSON, retained)
+  {base_topic}/daly/<name>/health  (error counters, retained, only sent when they change)
 
 Optional on-demand read trigger:
   Subscribe: {base_topic}/daly/<name>/cmd/read  (any payload triggers immediate read)
 
 This gateway serializes BLE reads (per device) to avoid BlueZ concurrency issues.
+Reads run in-process on a dedicated asyncio loop; each device keeps its BLE
+connection open between polls and only reconnects after an error.
 
 Optional runtime config:
   Publish JSON to: {base_topic}/daly/<name>/cmd/config
@@ -21,10 +24,12 @@ Optional runtime config:
 from __future__ import annotations
 
 import argparse
+import asyncio
+import heapq
 import json
 import os
 import queue
-import subprocess
+import socket
 import sys
 import threading
 import time
@@ -32,30 +37,26 @@ from dataclasses import dataclass
 from typing import Any, Dict, Optional
 
 import paho.mqtt.client as mqtt
+from bleak import BleakClient
+
+import daly_ble_read
+from _ble_cache import ensure_index, request_fast_connection, with_ble_lock as _with_ble_lock
+
+try:
+    import orjson
+except ImportError:  # optional, stdlib json as fallback
+    orjson = None
 
 
 def _now() -> float:
     return time.time()
 
-def _with_ble_lock(fn, *, timeout_s: float = 30.0):
-    """
-    Serialize BLE operations across multiple processes (JK gateway + DALY gateway).
-    BlueZ can fail with InProgress/Notify acquired when two processes use the same adapter.
-    """
-    import fcntl
-
-    lock_path = os.environ.get("BMS_BLE_LOCK_PATH", "/tmp/bms_ble.lock")
-    deadline = time.time() + float(timeout_s)
-    with open(lock_path, "w", encoding="utf-8") as f:
-        while True:
-            try:
-                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-                break
-            except BlockingIOError:
-                if time.time() >= deadline:
-                    raise TimeoutError("BLE lock timeout")
-                time.sleep(0.1)
-        return fn()
+
+def _dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    # compact like orjson: same bytes on the wire either way, and less to format and send
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
 
 
 def _load_json(path: str) -> Dict[str, Any]:
@@ -63,54 +64,14 @@ def _load_json(path: str) -> Dict[str, Any]:
         return json.load(f)
 
 
-def _run_read(
-    python: str, address: str, adapter: Optional[str], timeout_s: float, scan_timeout_s: float
-) -> Dict[str, Any]:
-    def _do():
-        cmd = [
-            python,
-            "-u",
-            os.path.join(os.path.dirname(__file__), "daly_ble_read.py"),
-            "--address",
-            address,
-            "--timeout",
-            str(timeout_s),
-            "--scan-timeout",
-            str(scan_timeout_s),
-        ]
-        if adapter:
-            cmd += ["--adapter", adapter]
-
-        return subprocess.run(cmd, capture_output=True, text=True)
-
-    p = _with_ble_lock(_do, timeout_s=max(30.0, float(timeout_s) + float(scan_timeout_s) + 10.0))
-    out = (p.stdout or "").strip()
-    if not out:
-        return {
-            "address": address,
-            "adapter": adapter,
-            "connected": False,
-            "got": {},
-            "status": {},
-            "error": {"type": "EmptyStdout", "message": "daly_ble_read.py produced no stdout", "rc": p.returncode},
-        }
-    try:
-        return json.loads(out)
-    except Exception:
-        return {
-            "address": address,
-            "adapter": adapter,
-            "connected": False,
-            "got": {},
-            "status": {},
-            "error": {
-                "type": "BadJSON",
-                "message": "Failed to parse daly_ble_read.py stdout as JSON",
-                "rc": p.returncode,
-                "stdout_head": out[:200],
-                "stderr_head": (p.stderr or "")[:200],
-            },
-        }
+# top-level config keys the gateway rewrites at runtime (see _save_cfg)
+_RUNTIME_CFG_KEYS = ("poll_interval_s", "timeout_s", "scan_timeout_s", "devices")
+
+
+def _cfg_item(key: str, value: Any) -> bytes:
+    # One top-level member exactly as json.dumps(cfg, indent=2) lays it out.
+    v = json.dumps(value, indent=2, ensure_ascii=False).replace("\n", "\n  ")
+    return ("  " + json.dumps(key, ensure_ascii=False) + ": " + v).encode("utf-8")
 
 
 @dataclass
@@ -120,10 +81,26 @@ class DeviceCfg:
     adapter: Optional[str]
 
 
+_ONLINE_TRUE = b"true"
+_ONLINE_FALSE = b"false"
+
+
+def _read_envelope(dev: DeviceCfg) -> Dict[str, Any]:
+    # Same shape as daly_ble_read.py's JSON output.
+    return {
+        "ts": _now(),
+        "address": dev.address,
+        "adapter": dev.adapter,
+        "connected": False,
+        "got": {},
+        "status": {},
+        "error": None,
+    }
+
+
 class Gateway:
-    def __init__(self, cfg: Dict[str, Any], python: str, config_path: str) -> None:
+    def __init__(self, cfg: Dict[str, Any], config_path: str) -> None:
         self.cfg = cfg
-        self.python = python
         self.config_path = config_path
 
         m = cfg.get("mqtt") or {}
@@ -132,11 +109,17 @@ class Gateway:
         self.mqtt_user = m.get("username")
         self.mqtt_pass = m.get("password")
         self.base_topic = str(m.get("base_topic", "bms")).strip().strip("/")
+        # base_topic has no leading/trailing "/", so topics are plain concatenation
+        self._prefix = f"{self.base_topic}/daly/"
         self.client_id = m.get("client_id") or f"daly-ble-gateway-{os.getpid()}"
 
         self.poll_interval_s = float(cfg.get("poll_interval_s", 10))
         self.timeout_s = float(cfg.get("timeout_s", 20))
         self.scan_timeout_s = float(cfg.get("scan_timeout_s", 10))
+        # raw is only re-published unchanged after this many seconds (0: every poll)
+        self.raw_heartbeat_s = float(cfg.get("raw_heartbeat_s", 60))
+        # re-request 0x94 (counts, charger/load flags, cycles) every Nth poll (1: every poll)
+        self.info_every = max(1, int(cfg.get("info_every", 10)))
 
         self.devices: list[DeviceCfg] = []
         for d in (cfg.get("devices") or []):
@@ -148,44 +131,134 @@ class Gateway:
                 )
             )
 
+        # Topics are fixed per device name: build them once, plus a reverse map for _on_message.
+        self._topics: Dict[str, Dict[str, str]] = {
+            d.name: {k: self._t(d, k) for k in ("raw", "online", "meta", "health", "cmd/read", "cmd/config")}
+            for d in self.devices
+        }
+        self._topic_to_dev: Dict[str, tuple[str, str]] = {}
+        for d in self.devices:
+            self._topic_to_dev[self._topics[d.name]["cmd/read"]] = (d.name, "cmd/read")
+            self._topic_to_dev[self._topics[d.name]["cmd/config"]] = (d.name, "cmd/config")
+
+        # Sections the gateway never touches (mqtt, ...) are encoded once; only the
+        # runtime keys are re-encoded on save. Key order follows the loaded file.
+        self._cfg_keys = list(cfg) + [k for k in _RUNTIME_CFG_KEYS if k not in cfg]
+        self._cfg_static: Dict[str, bytes] = {
+            k: _cfg_item(k, v) for k, v in cfg.items() if k not in _RUNTIME_CFG_KEYS
+        }
+        # hash of the config as last written (or as loaded), see _save_cfg
+        self._cfg_hash: Optional[int] = hash(self._render_cfg())
+
         self._cmdq: "queue.Queue[tuple[str, str, Optional[Dict[str, Any]]]]" = queue.Queue()
         self._stop = threading.Event()
+        # paho runs in the main thread (no loop_start): _pump() drives it, see run()
+        self._pumping = False
+        self._next_reconnect = 0.0
+
+        # BLE side: one asyncio loop in its own thread, one persistent session per device
+        # (connected BleakClient with notifications enabled, see daly_ble_read.DalyDeviceSession).
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._sessions: Dict[str, daly_ble_read.DalyDeviceSession] = {}
+        # Reconnect backoff per device (BLE loop only): delay before the next connect attempt
+        # after a failed one, 0.5 s doubling up to 5 s; cleared by a successful connect.
+        self._backoff: Dict[str, float] = {}
+        # per device: [errors since start, consecutive errors]; written by the BLE loop,
+        # published by the main thread whenever it differs from the last health message
+        self._errors: Dict[str, list[int]] = {d.name: [0, 0] for d in self.devices}
+        self._health_sent: Dict[str, tuple[int, int]] = {}
+        # per device: (fingerprint of the last published raw payload without ts, publish time)
+        self._last_raw: Dict[str, tuple[int, float]] = {}
+
+        # device name -> ((address, adapter), encoded meta prefix), see _meta_payload
+        self._meta_prefix: Dict[str, tuple[tuple[str, Optional[str]], bytes]] = {}
 
         self._client = mqtt.Client(client_id=self.client_id, clean_session=True)
         self._client.enable_logger()
+        # QoS 1 online/meta bursts for many devices must not stall on the default 20-message
+        # inflight window; queue without limit while offline (raw is QoS 0 and uses no slot)
+        self._client.max_inflight_messages_set(200)
+        self._client.max_queued_messages_set(0)
         if self.mqtt_user:
             self._client.username_pw_set(self.mqtt_user, self.mqtt_pass)
 
         for dev in self.devices:
-            self._client.will_set(self._t(dev, "online"), payload="false", retain=True, qos=1)
+            self._client.will_set(self._topics[dev.name]["online"], payload=_ONLINE_FALSE, retain=True, qos=1)
 
         self._client.on_connect = self._on_connect
         self._client.on_message = self._on_message
 
     def _t(self, dev: DeviceCfg, suffix: str) -> str:
-        return f"{self.base_topic}/daly/{dev.name}/{suffix}".replace("//", "/")
-
-    def _publish_json(self, topic: str, payload_obj: Any, retain: bool = False) -> None:
-        self._client.publish(topic, json.dumps(payload_obj, ensure_ascii=False), qos=1, retain=retain)
+        return self._prefix + dev.name + "/" + suffix
+
+    def _meta_payload(self, dev: DeviceCfg) -> bytes:
+        # meta only changes with cmd/config: encode name/address/adapter once per change
+        # and append the publish time (both encoders emit compact JSON, see _dumps)
+        key = (dev.address, dev.adapter)
+        hit = self._meta_prefix.get(dev.name)
+        if hit is None or hit[0] != key:
+            prefix = _dumps({"name": dev.name, "address": dev.address, "adapter": dev.adapter})[:-1] + b',"ts":'
+            hit = self._meta_prefix[dev.name] = (key, prefix)
+        return hit[1] + repr(_now()).encode("ascii") + b"}"
+
+    def _poll_messages(self, dev: DeviceCfg, payload: Dict[str, Any], batch: list[tuple[str, bytes, int, bool]]) -> None:
+        # Append (topic, payload bytes, qos, retain) for one poll result; see _flush_batch.
+        ok = bool(payload.get("connected")) and not payload.get("error")
+        topics = self._topics[dev.name]
+        # Idle batteries report the same values poll after poll: skip identical raw
+        # payloads (ts aside) until the heartbeat is due.
+        now = _now()
+        fp = hash(_dumps((payload.get("connected"), payload.get("got"), payload.get("status"), payload.get("error"))))
+        last = self._last_raw.get(dev.name)
+        if self.raw_heartbeat_s <= 0 or last is None or last[0] != fp or now - last[1] >= self.raw_heartbeat_s:
+            self._last_raw[dev.name] = (fp, now)
+            # raw is re-sent every poll and not retained: QoS 0, no PUBACK round trip
+            batch.append((topics["raw"], _dumps(payload), 0, False))
+        batch.append((topics["online"], _ONLINE_TRUE if ok else _ONLINE_FALSE, 1, True))
+        errs = self._errors.setdefault(dev.name, [0, 0])
+        health = (errs[0], errs[1])
+        if self._health_sent.get(dev.name) != health:
+            self._health_sent[dev.name] = health
+            health_obj = {
+                "errors": health[0],
+                "consecutive_errors": health[1],
+                "reconnect_backoff_s": self._backoff.get(dev.name, 0.0),
+                "ts": _now(),
+            }
+            batch.append((topics["health"], _dumps(health_obj), 1, True))
+
+    def _flush_batch(self, batch: list[tuple[str, bytes, int, bool]]) -> None:
+        # Everything is encoded already: publish in one tight run, then push out
+        # whatever paho could not write immediately (full socket buffer).
+        if not batch:
+            return
+        publish = self._client.publish
+        for topic, payload, qos, retain in batch:
+            publish(topic, payload, qos=qos, retain=retain)
+        try:
+            self._client.loop_write()
+        except Exception:
+            pass
 
     def _on_connect(self, client: mqtt.Client, userdata: Any, flags: Dict[str, Any], rc: int) -> None:
+        # publishes are small and latency matters more than packet count: no Nagle delay
+        try:
+            client.socket().setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except Exception:
+            pass
         for dev in self.devices:
-            client.subscribe(self._t(dev, "cmd/read"), qos=0)
-            client.subscribe(self._t(dev, "cmd/config"), qos=0)
+            client.subscribe(self._topics[dev.name]["cmd/read"], qos=0)
+            client.subscribe(self._topics[dev.name]["cmd/config"], qos=0)
         for dev in self.devices:
-            self._publish_json(
-                self._t(dev, "meta"),
-                {"name": dev.name, "address": dev.address, "adapter": dev.adapter, "ts": _now()},
-                retain=True,
-            )
-            client.publish(self._t(dev, "online"), payload="false", qos=1, retain=True)
+            client.publish(self._topics[dev.name]["meta"], self._meta_payload(dev), qos=1, retain=True)
+            client.publish(self._topics[dev.name]["online"], payload=_ONLINE_FALSE, qos=1, retain=True)
 
     def _on_message(self, client: mqtt.Client, userdata: Any, msg: mqtt.MQTTMessage) -> None:
-        parts = (msg.topic or "").split("/")
-        if len(parts) < 5:
+        hit = self._topic_to_dev.get(msg.topic or "")
+        if hit is None:
             return
-        name = parts[-3]
-        cmd = parts[-2] + "/" + parts[-1]
+        name, cmd = hit
         if cmd == "cmd/read":
             self._cmdq.put((name, "read", None))
             return
@@ -198,32 +271,212 @@ class Gateway:
             except Exception:
                 return
 
+    def _runtime_cfg(self) -> Dict[str, Any]:
+        return {
+            "poll_interval_s": self.poll_interval_s,
+            "timeout_s": self.timeout_s,
+            "scan_timeout_s": self.scan_timeout_s,
+            "devices": [{"name": d.name, "address": d.address, "adapter": d.adapter} for d in self.devices],
+        }
+
+    def _render_cfg(self) -> bytes:
+        # Byte-identical to json.dumps(cfg, indent=2, ensure_ascii=False) + "\n".
+        rt = self._runtime_cfg()
+        static = self._cfg_static
+        parts = [static[k] if k in static else _cfg_item(k, rt[k]) for k in self._cfg_keys]
+        return b"{\n" + b",\n".join(parts) + b"\n}\n"
+
     def _save_cfg(self) -> None:
         try:
-            cfg = dict(self.cfg)
-            cfg["poll_interval_s"] = self.poll_interval_s
-            cfg["timeout_s"] = self.timeout_s
-            cfg["scan_timeout_s"] = self.scan_timeout_s
-            cfg["devices"] = [{"name": d.name, "address": d.address, "adapter": d.adapter} for d in self.devices]
+            blob = self._render_cfg()
+            # Controllers may re-publish the same cmd/config periodically; skip the SD-card write then.
+            h = hash(blob)
+            if h == self._cfg_hash:
+                return
             tmp = self.config_path + ".tmp"
-            with open(tmp, "w", encoding="utf-8") as f:
-                json.dump(cfg, f, indent=2, ensure_ascii=False)
-                f.write("\n")
+            with open(tmp, "wb") as f:
+                f.write(blob)
             os.replace(tmp, self.config_path)
-            self.cfg = cfg
+            self.cfg = dict(self.cfg, **self._runtime_cfg())
+            self._cfg_hash = h
+        except Exception:
+            return
+
+    def _start_ble_loop(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name="daly-ble", daemon=True)
+        self._loop_thread.start()
+        # BlueZ manager + address index live as long as this loop: GetManagedObjects runs once
+        # here, later lookups are served from the signal-maintained index.
+        try:
+            asyncio.run_coroutine_threadsafe(ensure_index(), self._loop).result(timeout=10.0)
+        except Exception:
+            pass
+
+    def _stop_ble_loop(self) -> None:
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._disconnect_all(), loop).result(timeout=10.0)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+        if self._loop_thread is not None:
+            self._loop_thread.join(timeout=5.0)
+        self._loop = None
+        self._loop_thread = None
+
+    async def _drop_session(self, name: str) -> None:
+        session = self._sessions.pop(name, None)
+        if session is None:
+            return
+        try:
+            await session.client.disconnect()
+        except Exception:
+            pass
+
+    async def _disconnect_all(self) -> None:
+        for name in list(self._sessions):
+            await self._drop_session(name)
+
+    async def _get_session(self, dev: DeviceCfg) -> daly_ble_read.DalyDeviceSession:
+        session = self._sessions.get(dev.name)
+        if session is not None and session.client.is_connected:
+            return session
+        await self._drop_session(dev.name)
+        # after a failed connect, wait before hammering the adapter again
+        delay = self._backoff.get(dev.name)
+        if delay:
+            await asyncio.sleep(delay)
+        client: Optional[BleakClient] = None
+        try:
+            client_arg = await daly_ble_read.resolve_device(dev.address, dev.adapter, self.scan_timeout_s)
+            client = BleakClient(client_arg, timeout=self.timeout_s, adapter=dev.adapter)
+            await _with_ble_lock(client.connect, timeout_s=max(30.0, self.timeout_s + 10.0))
+            # a poll is ~10 request/response round trips: ask for the shortest interval (best-effort)
+            await request_fast_connection(client)
+            session = daly_ble_read.DalyDeviceSession(client, info_every=self.info_every)
+            # StartNotify once per connection; polls only write requests from here on
+            await _with_ble_lock(session.start, timeout_s=max(30.0, self.timeout_s + 10.0))
+        except BaseException:
+            self._backoff[dev.name] = min(delay * 2.0, 5.0) if delay else 0.5
+            if client is not None:
+                try:
+                    await client.disconnect()
+                except Exception:
+                    pass
+            raise
+        self._backoff.pop(dev.name, None)
+        self._sessions[dev.name] = session
+        return session
+
+    async def _poll(self, dev: DeviceCfg) -> Dict[str, Any]:
+        out = _read_envelope(dev)
+
+        async def _do() -> None:
+            session = await self._get_session(dev)
+            await session.poll(self.timeout_s, out)
+            out["connected"] = bool(session.client.is_connected)
+
+        errs = self._errors.setdefault(dev.name, [0, 0])
+        # Overall safety timeout: connect + scanning can hang when BlueZ is unhappy.
+        overall = self.timeout_s + self.scan_timeout_s + 10.0
+        try:
+            await asyncio.wait_for(_do(), timeout=overall)
+            errs[1] = 0
+        except Exception as e:
+            out["error"] = {"type": e.__class__.__name__, "message": str(e)}
+            errs[0] += 1
+            errs[1] += 1
+            # next poll starts from a fresh connection
+            await self._drop_session(dev.name)
+        return out
+
+    async def _poll_many(self, devs: list[DeviceCfg], results: Dict[str, Dict[str, Any]]) -> None:
+        # Devices on different adapters do not contend in BlueZ: poll the adapter groups
+        # concurrently, the devices of one adapter one after another.
+        # (adapter None = BlueZ default adapter, its own group)
+        groups: Dict[Optional[str], list[DeviceCfg]] = {}
+        for dev in devs:
+            groups.setdefault(dev.adapter, []).append(dev)
+
+        async def poll_group(group: list[DeviceCfg]) -> None:
+            for dev in group:
+                results[dev.name] = await self._poll(dev)
+
+        await asyncio.gather(*(poll_group(g) for g in groups.values()))
+
+    def _read(self, devs: list[DeviceCfg]) -> Dict[str, Dict[str, Any]]:
+        """Poll `devs` on the BLE loop; returns name -> payload for every device."""
+        assert self._loop is not None
+        results: Dict[str, Dict[str, Any]] = {}
+        fut = asyncio.run_coroutine_threadsafe(self._poll_many(devs, results), self._loop)
+        per_adapter: Dict[Optional[str], int] = {}
+        for dev in devs:
+            per_adapter[dev.adapter] = per_adapter.get(dev.adapter, 0) + 1
+        # the longest adapter group bounds the whole pass
+        deadline = _now() + max(per_adapter.values(), default=1) * (self.timeout_s + self.scan_timeout_s + 20.0)
+        try:
+            # keep MQTT alive (keepalive, PUBACKs, incoming commands) while the BLE loop works
+            while not fut.done() and _now() < deadline:
+                self._pump(0.05)
+            fut.result(timeout=0)
+        except Exception as e:
+            fut.cancel()
+            # devices that finished before the failure keep their results
+            for dev in devs:
+                if dev.name not in results:
+                    out = _read_envelope(dev)
+                    out["error"] = {"type": e.__class__.__name__, "message": str(e) or "BLE loop did not answer"}
+                    results[dev.name] = out
+        return results
+
+    def _forget_session(self, name: str) -> None:
+        # new address/adapter: earlier connect failures say nothing about it
+        self._backoff.pop(name, None)
+        if self._loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._drop_session(name), self._loop).result(timeout=10.0)
         except Exception:
+            pass
+
+    def _pump(self, timeout: float) -> None:
+        """
+        One paho network iteration in the calling thread. Returns as soon as the socket
+        has traffic, so callbacks (and _cmdq) are handled without a second thread.
+        """
+        if self._pumping:
             return
+        self._pumping = True
+        try:
+            rc = self._client.loop(timeout=max(0.0, timeout))
+            if rc == mqtt.MQTT_ERR_SUCCESS:
+                return
+            # No loop_forever() thread to reconnect for us; retry at most every 5 s.
+            now = _now()
+            if now >= self._next_reconnect:
+                self._next_reconnect = now + 5.0
+                try:
+                    self._client.reconnect()
+                    return
+                except Exception:
+                    pass
+            # loop() returns immediately while disconnected: don't spin
+            time.sleep(max(0.0, min(timeout, self._next_reconnect - now)))
+        except Exception:
+            return
+        finally:
+            self._pumping = False
 
     def connect(self) -> None:
+        self._start_ble_loop()
         self._client.connect(self.mqtt_host, self.mqtt_port, keepalive=30)
-        self._client.loop_start()
 
     def close(self) -> None:
         self._stop.set()
-        try:
-            self._client.loop_stop()
-        except Exception:
-            pass
+        self._stop_ble_loop()
         try:
             self._client.disconnect()
         except Exception:
@@ -235,7 +488,12 @@ class Gateway:
             return 2
         self.connect()
         try:
+            # next_poll holds each device's deadline; the heap orders (deadline, name) so the
+            # next due device is heap[0]. Rescheduling pushes a new entry, older ones for the
+            # same device go stale (deadline != next_poll[name]) and are dropped when popped.
             next_poll = {d.name: 0.0 for d in self.devices}
+            heap: list[tuple[float, str]] = [(0.0, d.name) for d in self.devices]
+            by_name = {d.name: d for d in self.devices}
             while not self._stop.is_set():
                 now = _now()
                 try:
@@ -243,10 +501,12 @@ class Gateway:
                         name, action, payload = self._cmdq.get_nowait()
                         if action == "read":
                             next_poll[name] = 0.0
+                            heapq.heappush(heap, (0.0, name))
                         elif action == "config" and isinstance(payload, dict):
                             for dev in self.devices:
                                 if dev.name != name:
                                     continue
+                                prev = (dev.address, dev.adapter)
                                 if payload.get("address"):
                                     dev.address = str(payload["address"]).strip()
                                 if "adapter" in payload:
@@ -254,12 +514,11 @@ class Gateway:
                                     a = None if a is None or str(a).strip() == "" else str(a).strip()
                                     if a is None or (a.startswith("hci") and a[3:].isdigit()):
                                         dev.adapter = a
-                                self._publish_json(
-                                    self._t(dev, "meta"),
-                                    {"name": dev.name, "address": dev.address, "adapter": dev.adapter, "ts": _now()},
-                                    retain=True,
-                                )
+                                if (dev.address, dev.adapter) != prev:
+                                    self._forget_session(dev.name)
+                                self._client.publish(self._topics[dev.name]["meta"], self._meta_payload(dev), qos=1, retain=True)
                                 next_poll[name] = 0.0
+                                heapq.heappush(heap, (0.0, name))
 
                             if "poll_interval_s" in payload:
                                 try:
@@ -287,30 +546,33 @@ class Gateway:
                 except queue.Empty:
                     pass
 
-                did_work = False
-                for dev in self.devices:
-                    if now < next_poll.get(dev.name, 0.0):
+                due: list[DeviceCfg] = []
+                while heap and heap[0][0] <= now:
+                    t, name = heapq.heappop(heap)
+                    if t != next_poll.get(name) or name not in by_name:
                         continue
-                    did_work = True
-                    next_poll[dev.name] = now + self.poll_interval_s
-
-                    payload = _run_read(
-                        python=self.python,
-                        address=dev.address,
-                        adapter=dev.adapter,
-                        timeout_s=self.timeout_s,
-                        scan_timeout_s=self.scan_timeout_s,
-                    )
-                    ok = bool(payload.get("connected")) and not payload.get("error")
-                    self._publish_json(self._t(dev, "raw"), payload, retain=False)
-                    self._client.publish(self._t(dev, "online"), payload=("true" if ok else "false"), qos=1, retain=True)
-
-                if not did_work:
-                    time.sleep(0.1)
+                    next_poll[name] = t = now + self.poll_interval_s
+                    heapq.heappush(heap, (t, name))
+                    due.append(by_name[name])
+
+                if due:
+                    payloads = self._read(due)
+                    batch: list[tuple[str, bytes, int, bool]] = []
+                    for dev in due:
+                        self._poll_messages(dev, payloads[dev.name], batch)
+                    self._flush_batch(batch)
+
+                # Sleep in paho's select until the next device is due or MQTT traffic arrives
+                # (cmd/read, cmd/config land in _cmdq and are handled on the next pass).
+                # Capped so keepalive pings and reconnects still happen with long poll intervals.
+                while heap and heap[0][0] != next_poll.get(heap[0][1]):
+                    heapq.heappop(heap)
+                next_deadline = heap[0][0] if heap else now + self.poll_interval_s
+                self._pump(min(1.0, next_deadline - _now()))
         finally:
             for dev in self.devices:
                 try:
-                    self._client.publish(self._t(dev, "online"), payload="false", qos=1, retain=True)
+                    self._client.publish(self._topics[dev.name]["online"], payload=_ONLINE_FALSE, qos=1, retain=True)
                 except Exception:
                     pass
             self.close()
@@ -320,11 +582,12 @@ class Gateway:
 def main() -> int:
     ap = argparse.ArgumentParser()
     ap.add_argument("--config", required=True)
-    ap.add_argument("--python", default=sys.executable)
+    # Reads no longer spawn daly_ble_read.py; flag kept so existing unit files keep working.
+    ap.add_argument("--python", default=None, help="(ignored, reads run in-process)")
     args = ap.parse_args()
 
     cfg = _load_json(args.config)
-    gw = Gateway(cfg, python=args.python, config_path=args.config)
+    gw = Gateway(cfg, config_path=args.config)
     return gw.run()
 
 
@@ -15,14 +15,21 @@ from __future__ import annotations
 import argparse
 import asyncio
 import json
+import struct
+import sys
 import time
 import traceback
-from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
 
 from bleak import BleakClient, BleakScanner, exc
-from bleak.backends.device import BLEDevice
-from bleak.backends.bluezdbus.manager import get_global_bluez_manager
+
+from _ble_cache import ble_device_from_bluez_cache, request_fast_connection
+
+try:
+    import orjson
+except ImportError:  # optional, stdlib json as fallback
+    orjson = None
 
 NOTIFY_UUID = "0000fff1-0000-1000-8000-00805f9b34fb"
 WRITE_UUID = "0000fff2-0000-1000-8000-00805f9b34fb"
@@ -32,8 +39,10 @@ def _now() -> float:
     return time.time()
 
 
-def _u16be(b: bytes, i: int) -> int:
-    return ((b[i] & 0xFF) << 8) | (b[i + 1] & 0xFF)
+def _dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
 
 
 def _checksum(frame_12: bytes) -> int:
@@ -46,6 +55,10 @@ def build_request(cmd: int) -> bytes:
     return bytes(fr)
 
 
+# the request set is fixed: build the 13-byte frames once
+REQ_FRAMES: Dict[int, bytes] = {c: build_request(c) for c in range(0x90, 0x99)}
+
+
 def verify_frame(fr: bytes) -> bool:
     if len(fr) != 13:
         return False
@@ -56,99 +69,113 @@ def verify_frame(fr: bytes) -> bool:
     return _checksum(fr[:12]) == (fr[12] & 0xFF)
 
 
-def split_frames(buf: bytearray) -> List[bytes]:
+@dataclass
+class FrameBuffer:
+    """
+    Receive buffer for split_frames. Consumed bytes are skipped by advancing `head`
+    instead of deleting them per notification; the bytearray is compacted only once
+    more than COMPACT_AT bytes are dead.
+    """
+
+    data: bytearray = field(default_factory=bytearray)
+    head: int = 0
+
+    COMPACT_AT = 2048
+
+    def extend(self, b: bytes | bytearray) -> None:
+        self.data.extend(b)
+
+    def clear(self) -> None:
+        self.data.clear()
+        self.head = 0
+
+    def __len__(self) -> int:
+        return len(self.data) - self.head
+
+
+def split_frames(buf: FrameBuffer) -> List[bytes]:
     """
     Extract valid 13-byte frames (start byte 0xA5) from an arbitrary byte stream.
     Keeps leftovers in the buffer.
     """
     out: List[bytes] = []
-    i = 0
-    # scan forward, extracting contiguous frames
-    while True:
-        # find start
-        while i < len(buf) and buf[i] != 0xA5:
+    data = buf.data
+    n = len(data)
+    i = buf.head
+    mv = memoryview(data)
+    try:
+        # scan forward, extracting contiguous frames; find() is a C-level memchr and
+        # the checksum is summed over a memoryview, so nothing is copied until a hit
+        while True:
+            i = data.find(0xA5, i)
+            if i < 0:
+                i = n
+                break
+            if n - i < 13:
+                break
+            if data[i + 3] == 0x08 and (sum(mv[i : i + 12]) & 0xFF) == data[i + 12]:
+                out.append(bytes(mv[i : i + 13]))
+                i += 13
+                continue
+            # false positive start byte; skip it
             i += 1
-        if i >= len(buf):
-            break
-        if len(buf) - i < 13:
-            break
-        cand = bytes(buf[i : i + 13])
-        if verify_frame(cand):
-            out.append(cand)
-            i += 13
-            continue
-        # false positive start byte; skip it
-        i += 1
-    # drop consumed bytes
-    if i > 0:
-        del buf[:i]
-    # cap runaway buffer
-    if len(buf) > 4096:
-        del buf[:-1024]
+    finally:
+        mv.release()
+    # cap runaway buffer (live part only)
+    if n - i > 4096:
+        i = n - 1024
+    # drop consumed bytes lazily
+    if i >= n:
+        data.clear()
+        i = 0
+    elif i > FrameBuffer.COMPACT_AT:
+        del data[:i]
+        i = 0
+    buf.head = i
     return out
 
 
-async def _ble_device_from_bluez_cache(address: str, adapter: Optional[str]) -> Optional[BLEDevice]:
-    try:
-        mgr = await get_global_bluez_manager()
-        await mgr.async_init()
-        props = getattr(mgr, "_properties", {}) or {}
-    except Exception:
-        return None
-
-    want = (address or "").strip().upper()
-    if not want:
-        return None
-
-    adapter_prefix = None
-    if adapter:
-        a = str(adapter).strip()
-        if a:
-            adapter_prefix = f"/org/bluez/{a}/"
-
-    for path, ifaces in props.items():
-        try:
-            dev1 = (ifaces or {}).get("org.bluez.Device1") or {}
-            addr = str(dev1.get("Address") or "").strip().upper()
-            if addr != want:
-                continue
-            if adapter_prefix and not str(path).startswith(adapter_prefix):
-                continue
-            name = dev1.get("Name") or dev1.get("Alias") or None
-            return BLEDevice(address=want, name=name, details={"path": path, "props": dev1})
-        except Exception:
-            continue
-    return None
+# DalyState.frames slot of a command: frames[cmd - CMD_BASE] (0x90..0x9F)
+CMD_BASE = 0x90
+CMD_SLOTS = 16
 
 
 @dataclass
 class DalyState:
-    frames: Dict[int, bytes]
     cell_frames: Dict[int, bytes]
     temp_frames: Dict[int, bytes]
     last_rx: float
+    # last frame per command, indexed by cmd - CMD_BASE; None = not received
+    frames: List[Optional[bytes]] = field(default_factory=lambda: [None] * CMD_SLOTS)
     cell_count: Optional[int] = None
     temp_count: Optional[int] = None
     cells_mv: Optional[List[int]] = None
     temps_c: Optional[List[float]] = None
+    # sensors reported across temp_frames, kept current by on_notify (see _temps_done)
+    temp_have: int = 0
+
+
+# big-endian payload layouts (8 bytes each)
+_S90 = struct.Struct(">HHHH")
+_S91 = struct.Struct(">HBHB")
+_S93 = struct.Struct(">BBBBI")
+_S94 = struct.Struct(">BBBBBH")
+_S95 = struct.Struct(">BHHHB")
 
 
 def decode_90(payload: bytes) -> Dict[str, Any]:
     # per DALY CAN protocol: V_total (0.1V), V_gather (0.1V), current (0.1A, 30000 offset), SOC (0.1%)
-    v_total = _u16be(payload, 0) / 10.0
-    v_gather = _u16be(payload, 2) / 10.0
-    raw_i = _u16be(payload, 4)
+    raw_vt, raw_vg, raw_i, raw_soc = _S90.unpack_from(payload)
+    v_total = raw_vt / 10.0
+    v_gather = raw_vg / 10.0
     current_a = (raw_i - 30000) / 10.0
-    soc = _u16be(payload, 6) / 10.0
+    soc = raw_soc / 10.0
     return {"voltage_total_v": round(v_total, 3), "voltage_gather_v": round(v_gather, 3), "current_a": round(current_a, 3), "soc_pct": round(soc, 1)}
 
 
 def decode_91(payload: bytes) -> Dict[str, Any]:
     # max cell mV, max cell no, min cell mV, min cell no
-    max_mv = _u16be(payload, 0)
-    max_no = payload[2]
-    min_mv = _u16be(payload, 3)
-    min_no = payload[5]
+    max_mv, max_no, min_mv, min_no = _S91.unpack_from(payload)
     return {
         "cell_max_v": round(max_mv / 1000.0, 3),
         "cell_max_no": int(max_no),
@@ -169,11 +196,9 @@ def decode_92(payload: bytes) -> Dict[str, Any]:
 
 def decode_93(payload: bytes) -> Dict[str, Any]:
     # state: 0 idle, 1 charge, 2 discharge
-    state = int(payload[0])
-    chg_mos = bool(payload[1])
-    dis_mos = bool(payload[2])
-    bms_life_cycles = int(payload[3])
-    remain_mah = (payload[4] << 24) | (payload[5] << 16) | (payload[6] << 8) | payload[7]
+    state, chg, dis, bms_life_cycles, remain_mah = _S93.unpack_from(payload)
+    chg_mos = bool(chg)
+    dis_mos = bool(dis)
     return {
         "state": state,
         "chg_mos": chg_mos,
@@ -184,12 +209,9 @@ def decode_93(payload: bytes) -> Dict[str, Any]:
 
 
 def decode_94(payload: bytes) -> Dict[str, Any]:
-    cell_count = int(payload[0])
-    temp_count = int(payload[1])
-    charger_status = bool(payload[2])
-    load_status = bool(payload[3])
-    io_bits = int(payload[4])
-    cycles = (payload[5] << 8) | payload[6]
+    cell_count, temp_count, charger, load, io_bits, cycles = _S94.unpack_from(payload)
+    charger_status = bool(charger)
+    load_status = bool(load)
     return {
         "cell_count": cell_count,
         "temp_count": temp_count,
@@ -202,11 +224,8 @@ def decode_94(payload: bytes) -> Dict[str, Any]:
 
 def decode_95_cells(payload: bytes) -> Dict[str, Any]:
     # frameNo + 3x u16(mV) + 1 reserved
-    frame_no = int(payload[0])
-    v1 = _u16be(payload, 1)
-    v2 = _u16be(payload, 3)
-    v3 = _u16be(payload, 5)
-    return {"frame_no": frame_no, "cells_mv": [v1, v2, v3], "reserved": int(payload[7])}
+    frame_no, v1, v2, v3, reserved = _S95.unpack_from(payload)
+    return {"frame_no": frame_no, "cells_mv": [v1, v2, v3], "reserved": reserved}
 
 
 def decode_96_temps(payload: bytes) -> Dict[str, Any]:
@@ -231,200 +250,325 @@ def decode_98(payload: bytes) -> Dict[str, Any]:
     return {"raw_hex": payload.hex()}
 
 
-async def main() -> int:
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--address", required=True)
-    ap.add_argument("--adapter", default=None, help="BlueZ adapter name, e.g. hci1")
-    ap.add_argument("--timeout", type=float, default=20.0)
-    ap.add_argument("--scan-timeout", type=float, default=10.0)
-    ap.add_argument("--debug", action="store_true")
-    args = ap.parse_args()
+async def resolve_device(address: str, adapter: Optional[str], scan_timeout: float) -> Any:
+    """BLEDevice from the BlueZ cache (or a scan as fallback); the plain address if neither finds it."""
+    dev: Any = await ble_device_from_bluez_cache(address, adapter)
+    if dev is None and scan_timeout > 0:
+        try:
+            dev = await BleakScanner.find_device_by_address(address, timeout=float(scan_timeout), adapter=adapter)
+        except TypeError:
+            dev = await BleakScanner.find_device_by_address(address, timeout=float(scan_timeout))
+    return dev if dev is not None else address
 
-    out: Dict[str, Any] = {
-        "ts": _now(),
-        "address": args.address,
-        "adapter": args.adapter,
-        "connected": False,
-        "got": {},
-        "status": {},
-        "error": None,
-    }
 
-    buf = bytearray()
-    st = DalyState(frames={}, cell_frames={}, temp_frames={}, last_rx=_now())
+# Completion conditions for DalyDeviceSession._wait, evaluated on every notification.
+def _core_done(st: DalyState) -> bool:
+    f = st.frames
+    return f[0x94 - CMD_BASE] is not None and f[0x90 - CMD_BASE] is not None
+
+
+def _cells_done(st: DalyState) -> bool:
+    # 3 cells per 0x95 frame
+    return bool(st.cell_count) and len(st.cell_frames) >= (int(st.cell_count) + 2) // 3
+
 
-    def on_notify(_: int, data: bytearray) -> None:
-        buf.extend(bytearray(data))
+def _temps_in(fr: bytes) -> int:
+    # temp bytes are payload[1:] = frame[5:12]; 0x00 means "no sensor"
+    return 7 - fr.count(0, 5, 12)
+
+
+def _temps_done(st: DalyState) -> bool:
+    return bool(st.temp_count) and st.temp_have >= int(st.temp_count)
+
+
+class DalyDeviceSession:
+    """
+    One DALY BMS on a connected BleakClient. Notifications are enabled once (start());
+    each poll() only writes the request frames and collects the answers, so a
+    long-lived session pays connect/StartNotify once instead of every cycle.
+    """
+
+    def __init__(self, client: BleakClient, info_every: int = 10) -> None:
+        self.client = client
+        # 0x94 (cell/temp counts, charger/load flags, cycles) is re-requested only every
+        # `info_every` polls; in between the last answer is reused. 1 = every poll.
+        self.info_every = max(1, int(info_every))
+        self.cached_94: Optional[bytes] = None
+        self.polls = 0
+        self.buf = FrameBuffer()
+        self.st = DalyState(cell_frames={}, temp_frames={}, last_rx=_now())
+        # condition of the phase poll() is waiting for; on_notify sets `ready` once it holds
+        self._want: Optional[Callable[[DalyState], bool]] = None
+        self.ready = asyncio.Event()
+        self.notifying = False
+
+    def on_notify(self, _: int, data: bytearray) -> None:
+        buf = self.buf
+        buf.extend(data)
         frames = split_frames(buf)
         if not frames:
             return
+        st = self.st
         st.last_rx = _now()
         for fr in frames:
             cmd = fr[2] & 0xFF
             if cmd == 0x95:
                 # index is first payload byte
-                try:
-                    fn = int(fr[4])  # payload[0]
-                    st.cell_frames[fn] = fr
-                except Exception:
-                    st.frames[cmd] = fr
+                st.cell_frames[fr[4]] = fr
             elif cmd == 0x96:
-                try:
-                    fn = int(fr[4])
+                fn = fr[4]
+                old = st.temp_frames.get(fn)
+                # repeats of a frame already seen (burst + re-request) change nothing
+                if old != fr:
+                    if old is not None:
+                        st.temp_have -= _temps_in(old)
                     st.temp_frames[fn] = fr
-                except Exception:
-                    st.frames[cmd] = fr
+                    st.temp_have += _temps_in(fr)
             else:
-                st.frames[cmd] = fr
+                i = cmd - CMD_BASE
+                if 0 <= i < CMD_SLOTS:
+                    st.frames[i] = fr
+        want = self._want
+        if want is not None and want(st):
+            self.ready.set()
+
+    async def _wait(self, want: Callable[[DalyState], bool], timeout: float) -> bool:
+        """Wait until want(self.st) holds or timeout; no polling, on_notify signals."""
+        self.ready.clear()
+        self._want = want
+        try:
+            if want(self.st):
+                return True
+            await asyncio.wait_for(self.ready.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._want = None
+
+    async def start(self) -> None:
+        """Enable notifications (retry a few times because BlueZ can be flaky)."""
+        if self.notifying:
+            return
+        last_err = None
+        for _ in range(3):
+            try:
+                await self.client.start_notify(NOTIFY_UUID, self.on_notify)
+                last_err = None
+                break
+            except Exception as e:
+                last_err = e
+                await asyncio.sleep(0.6)
+        if last_err is not None:
+            raise last_err
+        self.notifying = True
+
+    async def stop(self) -> None:
+        if not self.notifying:
+            return
+        self.notifying = False
+        try:
+            await self.client.stop_notify(NOTIFY_UUID)
+        except Exception:
+            pass
+
+    async def poll(self, timeout: float, out: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Run one request/response cycle. Fills (and returns) out["got"]/out["status"] as
+        frames are decoded, so a caller that hits a timeout still sees the partial result.
+        """
+        if out is None:
+            out = {}
+        out.setdefault("got", {})
+        out.setdefault("status", {})
+
+        client = self.client
+        # fresh state per poll; the notify subscription stays
+        self.buf.clear()
+        st = self.st = DalyState(cell_frames={}, temp_frames={}, last_rx=_now())
+
+        # request set (order matters: 94 gives cell_count/temp_count)
+        # Written back-to-back: write commands are queued by BlueZ and the BMS answers
+        # them in order, pacing each write by 120 ms only cost ~1 s per poll.
+        cmds = [0x94, 0x90, 0x91, 0x92, 0x93, 0x95, 0x96, 0x97, 0x98]
+        cached_94 = self.cached_94
+        if cached_94 is not None:
+            # a fresh 0x94 answer overwrites this; without one the cached frame stands in
+            st.frames[0x94 - CMD_BASE] = cached_94
+            if self.polls % self.info_every:
+                cmds.remove(0x94)
+        self.polls += 1
+        write = client.write_gatt_char
+        for c in cmds:
+            await write(WRITE_UUID, REQ_FRAMES[c], response=False)
+        await asyncio.sleep(0.05)
+
+        # wait until we have at least 90/94 (core)
+        await self._wait(_core_done, float(timeout))
+        f = st.frames
+        if f[0x94 - CMD_BASE] is not None:
+            self.cached_94 = f[0x94 - CMD_BASE]
+
+        # decode core first (94)
+        fr = f[0x94 - CMD_BASE]
+        if fr is not None:
+            payload = fr[4:12]
+            d94 = decode_94(payload)
+            out["status"]["info_94"] = d94
+            # "cached": no fresh 0x94 this poll, charger/load flags and cycles may be up to
+            # info_every - 1 polls old
+            out["got"]["94"] = "cached" if fr is cached_94 else True
+            st.cell_count = d94.get("cell_count")
+            st.temp_count = d94.get("temp_count")
+
+        fr = f[0x90 - CMD_BASE]
+        if fr is not None:
+            out["status"]["pack_90"] = decode_90(fr[4:12])
+            out["got"]["90"] = True
+        fr = f[0x91 - CMD_BASE]
+        if fr is not None:
+            out["status"]["cell_minmax_91"] = decode_91(fr[4:12])
+            out["got"]["91"] = True
+        fr = f[0x92 - CMD_BASE]
+        if fr is not None:
+            out["status"]["temp_minmax_92"] = decode_92(fr[4:12])
+            out["got"]["92"] = True
+        fr = f[0x93 - CMD_BASE]
+        if fr is not None:
+            out["status"]["mos_93"] = decode_93(fr[4:12])
+            out["got"]["93"] = True
+        fr = f[0x97 - CMD_BASE]
+        if fr is not None:
+            out["status"]["balance_97"] = decode_97(fr[4:12])
+            out["got"]["97"] = True
+        fr = f[0x98 - CMD_BASE]
+        if fr is not None:
+            out["status"]["fault_98"] = decode_98(fr[4:12])
+            out["got"]["98"] = True
+
+        # assemble cells (0x95): request again and wait for all frames
+        st.cell_frames.clear()
+        await client.write_gatt_char(WRITE_UUID, REQ_FRAMES[0x95], response=False)
+        # until all frames for cell_count are in (without cell_count: whatever arrives in 2.5 s)
+        await self._wait(_cells_done, 2.5)
+        # One slot per 0x95 frame (3 cells each), indexed by frame number: no sort needed.
+        # Without cell_count the slot list grows to the highest frame number seen.
+        need = (int(st.cell_count) + 2) // 3 if st.cell_count else 0
+        slots: List[Optional[List[int]]] = [None] * need
+        frame_base: Optional[int] = None
+        for fn, fr in list(st.cell_frames.items()):
+            d = decode_95_cells(fr[4:12])
+            if frame_base is None:
+                frame_base = 0 if int(d["frame_no"]) == 0 else 1
+            idx = int(d["frame_no"]) - frame_base
+            if idx < 0 or (need and idx >= need):
+                continue
+            if idx >= len(slots):
+                slots.extend([None] * (idx + 1 - len(slots)))
+            slots[idx] = d["cells_mv"]
+
+        if any(c is not None for c in slots):
+            # flatten in order (missing frames are skipped, as before)
+            flat: List[int] = []
+            for cells in slots:
+                if cells is not None:
+                    flat.extend(cells)
+            if st.cell_count:
+                flat = flat[: int(st.cell_count)]
+            out["status"]["cells_95"] = {"cells_v": [round(mv / 1000.0, 3) for mv in flat], "cell_count": len(flat)}
+            out["got"]["95"] = True
+
+        # assemble temps (0x96)
+        st.temp_frames.clear()
+        st.temp_have = 0
+        await client.write_gatt_char(WRITE_UUID, REQ_FRAMES[0x96], response=False)
+        await self._wait(_temps_done, 2.5)
+        temps: List[int] = []
+        # iterate frames in order by frame_no
+        for fn in sorted(st.temp_frames.keys()):
+            fr = st.temp_frames[fn]
+            d = decode_96_temps(fr[4:12])
+            for tv in d["temps_c"]:
+                if tv is None:
+                    continue
+                temps.append(int(tv))
+        if temps:
+            if st.temp_count:
+                temps = temps[: int(st.temp_count)]
+            out["status"]["temps_96"] = {"temps_c": temps, "temp_count": len(temps)}
+            out["got"]["96"] = True
+
+        return out
+
+
+async def read_once(client: BleakClient, timeout: float, out: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    One-shot read on an already connected client: start notify, poll once, stop notify.
+    The connection is left open. Long-running callers keep a DalyDeviceSession instead.
+    """
+    session = DalyDeviceSession(client)
+    await session.start()
+    try:
+        return await session.poll(timeout, out)
+    finally:
+        await session.stop()
 
-    async def run_once(client: BleakClient) -> int:
-        async with client:
-            # notifications (retry a few times because BlueZ can be flaky)
-            last_err = None
-            for _ in range(3):
-                try:
-                    await client.start_notify(NOTIFY_UUID, on_notify)
-                    last_err = None
-                    break
-                except Exception as e:
-                    last_err = e
-                    await asyncio.sleep(0.6)
-            if last_err is not None:
-                raise last_err
-
-            # request set (order matters: 94 gives cell_count/temp_count)
-            cmds = [0x94, 0x90, 0x91, 0x92, 0x93, 0x95, 0x96, 0x97, 0x98]
-            for c in cmds:
-                await client.write_gatt_char(WRITE_UUID, build_request(c), response=False)
-                await asyncio.sleep(0.12)
-
-            t_end = _now() + float(args.timeout)
-            # wait until we have at least 90/94 (core)
-            while _now() < t_end and (0x94 not in st.frames or 0x90 not in st.frames):
-                await asyncio.sleep(0.05)
-
-            # decode core first (94)
-            if 0x94 in st.frames:
-                payload = st.frames[0x94][4:12]
-                d94 = decode_94(payload)
-                out["status"]["info_94"] = d94
-                out["got"]["94"] = True
-                st.cell_count = d94.get("cell_count")
-                st.temp_count = d94.get("temp_count")
-
-            if 0x90 in st.frames:
-                out["status"]["pack_90"] = decode_90(st.frames[0x90][4:12])
-                out["got"]["90"] = True
-            if 0x91 in st.frames:
-                out["status"]["cell_minmax_91"] = decode_91(st.frames[0x91][4:12])
-                out["got"]["91"] = True
-            if 0x92 in st.frames:
-                out["status"]["temp_minmax_92"] = decode_92(st.frames[0x92][4:12])
-                out["got"]["92"] = True
-            if 0x93 in st.frames:
-                out["status"]["mos_93"] = decode_93(st.frames[0x93][4:12])
-                out["got"]["93"] = True
-            if 0x97 in st.frames:
-                out["status"]["balance_97"] = decode_97(st.frames[0x97][4:12])
-                out["got"]["97"] = True
-            if 0x98 in st.frames:
-                out["status"]["fault_98"] = decode_98(st.frames[0x98][4:12])
-                out["got"]["98"] = True
-
-            # assemble cells (0x95): request again and wait for all frames
-            st.cell_frames.clear()
-            await client.write_gatt_char(WRITE_UUID, build_request(0x95), response=False)
-            await asyncio.sleep(0.15)
-            t_cells_end = _now() + 2.5
-            cells_by_no: Dict[int, List[int]] = {}
-            frame_base: Optional[int] = None
-            while _now() < t_cells_end:
-                # consume any pending frames first
-                _ = split_frames(buf)
-                for fn, fr in list(st.cell_frames.items()):
-                    d = decode_95_cells(fr[4:12])
-                    if frame_base is None:
-                        frame_base = 0 if int(d["frame_no"]) == 0 else 1
-                    idx = int(d["frame_no"]) - frame_base
-                    if idx >= 0:
-                        cells_by_no[idx] = d["cells_mv"]
-                await asyncio.sleep(0.05)
-                if st.cell_count and cells_by_no:
-                    # enough frames collected?
-                    need = (int(st.cell_count) + 2) // 3  # 3 cells per frame
-                    if len(cells_by_no) >= need:
-                        break
-
-            if cells_by_no:
-                # flatten in order
-                flat: List[int] = []
-                for idx in sorted(cells_by_no.keys()):
-                    flat.extend(cells_by_no[idx])
-                if st.cell_count:
-                    flat = flat[: int(st.cell_count)]
-                out["status"]["cells_95"] = {"cells_v": [round(mv / 1000.0, 3) for mv in flat], "cell_count": len(flat)}
-                out["got"]["95"] = True
-
-            # assemble temps (0x96)
-            st.temp_frames.clear()
-            await client.write_gatt_char(WRITE_UUID, build_request(0x96), response=False)
-            await asyncio.sleep(0.15)
-            t_t_end = _now() + 2.5
-            temps: List[int] = []
-            while _now() < t_t_end:
-                _ = split_frames(buf)
-                # iterate frames in order by frame_no
-                for fn in sorted(st.temp_frames.keys()):
-                    fr = st.temp_frames[fn]
-                    d = decode_96_temps(fr[4:12])
-                    for tv in d["temps_c"]:
-                        if tv is None:
-                            continue
-                        temps.append(int(tv))
-                await asyncio.sleep(0.05)
-                if st.temp_count and temps and len(temps) >= int(st.temp_count):
-                    break
-            if temps:
-                if st.temp_count:
-                    temps = temps[: int(st.temp_count)]
-                out["status"]["temps_96"] = {"temps_c": temps, "temp_count": len(temps)}
-                out["got"]["96"] = True
 
-            try:
-                await client.stop_notify(NOTIFY_UUID)
-            except Exception:
-                pass
+async def read_device(
+    address: str,
+    adapter: Optional[str],
+    timeout: float,
+    scan_timeout: float,
+    debug: bool = False,
+) -> Dict[str, Any]:
+    """
+    Connect, run read_once, disconnect. Never raises: errors end up in out["error"].
+    This is the whole CLI read as a coroutine, for callers that want one-shot reads in-process.
+    """
+    out: Dict[str, Any] = {
+        "ts": _now(),
+        "address": address,
+        "adapter": adapter,
+        "connected": False,
+        "got": {},
+        "status": {},
+        "error": None,
+    }
 
+    async def run_once(client: BleakClient) -> None:
+        async with client:
+            await request_fast_connection(client)
+            await read_once(client, timeout, out)
             out["connected"] = bool(client.is_connected)
-            return 0
 
     try:
-        cached = await _ble_device_from_bluez_cache(args.address, args.adapter)
-        dev: Any = cached
-        if dev is None and args.scan_timeout > 0:
-            try:
-                dev = await BleakScanner.find_device_by_address(args.address, timeout=float(args.scan_timeout), adapter=args.adapter)
-            except TypeError:
-                dev = await BleakScanner.find_device_by_address(args.address, timeout=float(args.scan_timeout))
-        client_arg: Any = dev if dev is not None else args.address
+        client_arg = await resolve_device(address, adapter, scan_timeout)
         # Overall safety timeout: connect + scanning can hang when BlueZ is unhappy.
-        overall = float(args.timeout) + float(args.scan_timeout) + 10.0
-        await asyncio.wait_for(run_once(BleakClient(client_arg, timeout=args.timeout, adapter=args.adapter)), timeout=overall)
-        # success path prints JSON too
-        print(json.dumps(out, ensure_ascii=False))
-        return 0
+        overall = float(timeout) + float(scan_timeout) + 10.0
+        await asyncio.wait_for(run_once(BleakClient(client_arg, timeout=timeout, adapter=adapter)), timeout=overall)
     except exc.BleakDeviceNotFoundError as e_nf:
         out["error"] = {"type": e_nf.__class__.__name__, "message": str(e_nf)}
-        print(json.dumps(out, ensure_ascii=False))
-        return 0
     except Exception as e:
         out["error"] = {"type": e.__class__.__name__, "message": str(e)}
-        if args.debug:
+        if debug:
             out["traceback"] = traceback.format_exc()
-        print(json.dumps(out, ensure_ascii=False))
-        return 0
-    finally:
-        pass
+    return out
+
+
+async def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--address", required=True)
+    ap.add_argument("--adapter", default=None, help="BlueZ adapter name, e.g. hci1")
+    ap.add_argument("--timeout", type=float, default=20.0)
+    ap.add_argument("--scan-timeout", type=float, default=10.0)
+    ap.add_argument("--debug", action="store_true")
+    args = ap.parse_args()
+
+    out = await read_device(args.address, args.adapter, args.timeout, args.scan_timeout, debug=args.debug)
+    # always JSON, errors included
+    sys.stdout.buffer.write(_dumps(out) + b"\n")
+    sys.stdout.buffer.flush()
+    return 0
 
 
 if __name__ == "__main__":
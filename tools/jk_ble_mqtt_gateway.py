@@ -10,21 +10,32 @@ Publishes one JSON payload per poll cycle to:
 Optional on-demand read trigger:
   Subscribe: {base_topic}/jk/<name>/cmd/read  (any payload triggers immediate read)
 
+Optional handoff to a writer (jk_ble_write.py / jk_ble_writed.py):
+  Publish to: {base_topic}/jk/<name>/cmd/release  (payload: seconds, empty = 60)
+  The gateway disconnects from that BMS and skips its polls for that long (cmd/read resumes).
+
 Optional runtime config:
   Publish JSON to: {base_topic}/jk/<name>/cmd/config
-    {"address":"..","adapter":"hci0","poll_interval_s":10,"timeout_s":20,"scan_timeout_s":5}
+    {"address":"..","adapter":"hci0","poll_interval_s":10,"timeout_s":20,"scan_timeout_s":5,
+     "keep_connected":false}
   The gateway applies changes in-memory and persists back to the config file.
 
 The gateway avoids concurrent BLE operations by serializing reads per device.
+Reads run in-process on a dedicated asyncio loop, no Python start per poll. By default each
+poll connects and disconnects again (writers can connect in between); with
+"keep_connected": true the session (jk_ble_read.JKDeviceSession) stays connected and only
+reconnects after an error or cmd/release.
 """
 
 from __future__ import annotations
 
 import argparse
+import asyncio
+import heapq
 import json
 import os
 import queue
-import subprocess
+import socket
 import sys
 import threading
 import time
@@ -32,30 +43,26 @@ from dataclasses import dataclass
 from typing import Any, Dict, Optional
 
 import paho.mqtt.client as mqtt
+from bleak import BleakClient, exc
+
+import jk_ble_read
+from _ble_cache import request_fast_connection, with_ble_lock as _with_ble_lock
+
+try:
+    import orjson
+except ImportError:  # optional, stdlib json as fallback
+    orjson = None
 
 
 def _now() -> float:
     return time.time()
 
-def _with_ble_lock(fn, *, timeout_s: float = 30.0):
-    """
-    Serialize BLE operations across multiple processes (JK gateway + DALY gateway).
-    BlueZ can fail with InProgress/Notify acquired when two processes use the same adapter.
-    """
-    import fcntl
-
-    lock_path = os.environ.get("BMS_BLE_LOCK_PATH", "/tmp/bms_ble.lock")
-    deadline = time.time() + float(timeout_s)
-    with open(lock_path, "w", encoding="utf-8") as f:
-        while True:
-            try:
-                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-                break
-            except BlockingIOError:
-                if time.time() >= deadline:
-                    raise TimeoutError("BLE lock timeout")
-                time.sleep(0.1)
-        return fn()
+
+def _dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    # compact like orjson: same bytes on the wire either way, and less to format and send
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
 
 
 def _load_json(path: str) -> Dict[str, Any]:
@@ -63,62 +70,6 @@ def _load_json(path: str) -> Dict[str, Any]:
         return json.load(f)
 
 
-def _env_default(name: str, default: Optional[str]) -> Optional[str]:
-    v = os.environ.get(name)
-    return default if v is None or v == "" else v
-
-
-def _run_read(python: str, address: str, adapter: Optional[str], timeout_s: float, scan_timeout_s: float) -> Dict[str, Any]:
-    def _do():
-        cmd = [
-            python,
-            "-u",
-            os.path.join(os.path.dirname(__file__), "jk_ble_read.py"),
-            "--address",
-            address,
-            "--timeout",
-            str(timeout_s),
-            "--scan-timeout",
-            str(scan_timeout_s),
-        ]
-        if adapter:
-            cmd += ["--adapter", adapter]
-
-        return subprocess.run(cmd, capture_output=True, text=True)
-
-    p = _with_ble_lock(_do, timeout_s=max(30.0, float(timeout_s) + float(scan_timeout_s) + 10.0))
-    # jk_ble_read.py always prints JSON; in worst case, still provide a JSON envelope here.
-    out = (p.stdout or "").strip()
-    if not out:
-        return {
-            "address": address,
-            "adapter": adapter,
-            "connected": False,
-            "model_nbr": None,
-            "got": {},
-            "status": {},
-            "error": {"type": "EmptyStdout", "message": "jk_ble_read.py produced no stdout", "rc": p.returncode},
-        }
-    try:
-        return json.loads(out)
-    except Exception:
-        return {
-            "address": address,
-            "adapter": adapter,
-            "connected": False,
-            "model_nbr": None,
-            "got": {},
-            "status": {},
-            "error": {
-                "type": "BadJSON",
-                "message": "Failed to parse jk_ble_read.py stdout as JSON",
-                "rc": p.returncode,
-                "stdout_head": out[:200],
-                "stderr_head": (p.stderr or "")[:200],
-            },
-        }
-
-
 @dataclass
 class DeviceCfg:
     name: str
@@ -126,10 +77,26 @@ class DeviceCfg:
     adapter: Optional[str]
 
 
+_ONLINE_TRUE = b"true"
+_ONLINE_FALSE = b"false"
+
+
+def _read_envelope(dev: DeviceCfg) -> Dict[str, Any]:
+    # Same shape as jk_ble_read.py's JSON output.
+    return {
+        "address": dev.address,
+        "adapter": dev.adapter,
+        "connected": False,
+        "model_nbr": None,
+        "got": {},
+        "status": {},
+        "error": None,
+    }
+
+
 class Gateway:
-    def __init__(self, cfg: Dict[str, Any], python: str, config_path: str) -> None:
+    def __init__(self, cfg: Dict[str, Any], config_path: str) -> None:
         self.cfg = cfg
-        self.python = python
         self.config_path = config_path
 
         m = cfg.get("mqtt") or {}
@@ -138,11 +105,16 @@ class Gateway:
         self.mqtt_user = m.get("username")
         self.mqtt_pass = m.get("password")
         self.base_topic = m.get("base_topic", "bms").strip().strip("/")
+        # base_topic has no leading/trailing "/", so topics are plain concatenation
+        self._prefix = f"{self.base_topic}/jk/"
         self.client_id = m.get("client_id") or f"jk-ble-gateway-{os.getpid()}"
 
         self.poll_interval_s = float(cfg.get("poll_interval_s", 10))
         self.timeout_s = float(cfg.get("timeout_s", 20))
         self.scan_timeout_s = float(cfg.get("scan_timeout_s", 0))
+        # Keep each BMS connected between polls (opt-in). JK BMS accept one central only, so
+        # this locks out jk_ble_write.py/jk_ble_writed.py unless they ask via cmd/release.
+        self.keep_connected = bool(cfg.get("keep_connected", False))
 
         self.devices = []
         for d in (cfg.get("devices") or []):
@@ -154,56 +126,105 @@ class Gateway:
                 )
             )
 
+        # exact command topic -> (device name, command): _on_message runs on paho's network
+        # thread, one dict lookup there instead of splitting every topic
+        self._topic_to_dev: Dict[str, tuple[str, str]] = {}
+        for d in self.devices:
+            for cmd in ("cmd/read", "cmd/config", "cmd/release"):
+                self._topic_to_dev[self._t(d, cmd)] = (d.name, cmd)
+
         self._cmdq: "queue.Queue[tuple[str, str, Optional[Dict[str, Any]]]]" = queue.Queue()
         self._stop = threading.Event()
+        # set by _on_message so the main loop wakes up without polling the queue
+        self._wake = threading.Event()
+
+        # BLE work runs on one long-lived event loop in its own thread (see _start_ble_loop),
+        # with one persistent session per device (connected client, notifications enabled)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._sessions: Dict[str, jk_ble_read.JKDeviceSession] = {}
+        # Reconnect backoff per device (BLE loop only): delay before the next connect attempt
+        # after a failed one, 0.5 s doubling up to 5 s; cleared by a successful connect.
+        self._backoff: Dict[str, float] = {}
+        # device name -> asyncio.Lock, created on the BLE loop
+        self._dev_locks: Dict[str, asyncio.Lock] = {}
+
+        # device name -> ((address, adapter), encoded meta prefix), see _meta_payload
+        self._meta_prefix: Dict[str, tuple[tuple[str, Optional[str]], bytes]] = {}
 
         self._client = mqtt.Client(client_id=self.client_id, clean_session=True)
         self._client.enable_logger()
+        # QoS 1 online/meta bursts for many devices must not stall on the default 20-message
+        # inflight window; queue without limit while offline (raw is QoS 0 and uses no slot)
+        self._client.max_inflight_messages_set(200)
+        self._client.max_queued_messages_set(0)
+        # loop_start() reconnects on its own: retry quickly first, back off to 30 s
+        self._client.reconnect_delay_set(min_delay=1, max_delay=30)
         if self.mqtt_user:
             self._client.username_pw_set(self.mqtt_user, self.mqtt_pass)
 
         # LWT: offline markers
         for dev in self.devices:
-            self._client.will_set(self._t(dev, "online"), payload="false", retain=True, qos=1)
+            self._client.will_set(self._t(dev, "online"), payload=_ONLINE_FALSE, retain=True, qos=1)
 
         self._client.on_connect = self._on_connect
         self._client.on_message = self._on_message
 
     def _t(self, dev: DeviceCfg, suffix: str) -> str:
-        return f"{self.base_topic}/jk/{dev.name}/{suffix}".replace("//", "/")
-
-    def _publish_json(self, topic: str, payload_obj: Any, retain: bool = False) -> None:
-        self._client.publish(topic, json.dumps(payload_obj, ensure_ascii=False), qos=1, retain=retain)
+        return self._prefix + dev.name + "/" + suffix
+
+    def _meta_payload(self, dev: DeviceCfg) -> bytes:
+        # meta only changes with cmd/config: encode name/address/adapter once per change
+        # and append the publish time (both encoders emit compact JSON, see _dumps)
+        key = (dev.address, dev.adapter)
+        hit = self._meta_prefix.get(dev.name)
+        if hit is None or hit[0] != key:
+            prefix = _dumps({"name": dev.name, "address": dev.address, "adapter": dev.adapter})[:-1] + b',"ts":'
+            hit = self._meta_prefix[dev.name] = (key, prefix)
+        return hit[1] + repr(_now()).encode("ascii") + b"}"
+
+    def _flush_batch(self, batch: list[tuple[str, bytes, int, bool]]) -> None:
+        # Everything is encoded already: publish in one tight run so the network thread
+        # (loop_start) wakes once per cycle and drains the lot, not once per device read.
+        publish = self._client.publish
+        for topic, payload, qos, retain in batch:
+            publish(topic, payload, qos=qos, retain=retain)
 
     def _on_connect(self, client: mqtt.Client, userdata: Any, flags: Dict[str, Any], rc: int) -> None:
+        # publishes are small and latency matters more than packet count: no Nagle delay
+        try:
+            client.socket().setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except Exception:
+            pass
         # Subscribe to on-demand read triggers
         for dev in self.devices:
             client.subscribe(self._t(dev, "cmd/read"), qos=0)
             client.subscribe(self._t(dev, "cmd/config"), qos=0)
+            client.subscribe(self._t(dev, "cmd/release"), qos=0)
 
         # Publish retained meta + mark online=false until first good read
         for dev in self.devices:
-            self._publish_json(
-                self._t(dev, "meta"),
-                {"name": dev.name, "address": dev.address, "adapter": dev.adapter, "ts": _now()},
-                retain=True,
-            )
-            client.publish(self._t(dev, "online"), payload="false", qos=1, retain=True)
+            client.publish(self._t(dev, "meta"), self._meta_payload(dev), qos=1, retain=True)
+            client.publish(self._t(dev, "online"), payload=_ONLINE_FALSE, qos=1, retain=True)
 
     def _on_message(self, client: mqtt.Client, userdata: Any, msg: mqtt.MQTTMessage) -> None:
-        topic = msg.topic or ""
-        # Expect: {base}/jk/<name>/cmd/read
-        parts = topic.split("/")
-        # minimum: base, jk, name, cmd, read
-        if len(parts) < 5:
-            return
-        try:
-            name = parts[-3]
-            cmd = parts[-2] + "/" + parts[-1]
-        except Exception:
+        hit = self._topic_to_dev.get(msg.topic or "")
+        if hit is None:
             return
+        name, cmd = hit
         if cmd == "cmd/read":
             self._cmdq.put((name, "read", None))
+            self._wake.set()
+            return
+        if cmd == "cmd/release":
+            # payload: seconds to stay away from the device (empty = 60)
+            try:
+                raw = msg.payload.decode("utf-8") if isinstance(msg.payload, (bytes, bytearray)) else str(msg.payload)
+                secs = float(raw) if raw.strip() else 60.0
+            except Exception:
+                secs = 60.0
+            self._cmdq.put((name, "release", {"seconds": max(0.0, min(secs, 3600.0))}))
+            self._wake.set()
             return
         if cmd == "cmd/config":
             try:
@@ -211,6 +232,7 @@ class Gateway:
                 cfg = json.loads(raw) if raw.strip() else {}
                 if isinstance(cfg, dict):
                     self._cmdq.put((name, "config", cfg))
+                    self._wake.set()
             except Exception:
                 return
 
@@ -220,6 +242,7 @@ class Gateway:
             cfg["poll_interval_s"] = self.poll_interval_s
             cfg["timeout_s"] = self.timeout_s
             cfg["scan_timeout_s"] = self.scan_timeout_s
+            cfg["keep_connected"] = self.keep_connected
             cfg["devices"] = [{"name": d.name, "address": d.address, "adapter": d.adapter} for d in self.devices]
             tmp = self.config_path + ".tmp"
             with open(tmp, "w", encoding="utf-8") as f:
@@ -230,12 +253,161 @@ class Gateway:
         except Exception:
             return
 
+    def _start_ble_loop(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name="jk-ble", daemon=True)
+        self._loop_thread.start()
+
+    def _stop_ble_loop(self) -> None:
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._disconnect_all(), loop).result(timeout=10.0)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+        if self._loop_thread is not None:
+            self._loop_thread.join(timeout=5.0)
+        self._loop = None
+        self._loop_thread = None
+
+    async def _drop_session(self, name: str) -> None:
+        session = self._sessions.pop(name, None)
+        if session is None:
+            return
+        try:
+            await session.client.disconnect()
+        except Exception:
+            pass
+
+    async def _disconnect_all(self) -> None:
+        for name in list(self._sessions):
+            session = self._sessions.get(name)
+            if session is not None:
+                await session.stop()
+            await self._drop_session(name)
+
+    async def _get_session(self, dev: DeviceCfg) -> jk_ble_read.JKDeviceSession:
+        session = self._sessions.get(dev.name)
+        if session is not None and session.client.is_connected:
+            return session
+        await self._drop_session(dev.name)
+        # after a failed connect, wait before hammering the adapter again
+        delay = self._backoff.get(dev.name)
+        if delay:
+            await asyncio.sleep(delay)
+        lock_s = max(30.0, self.timeout_s + self.scan_timeout_s + 10.0)
+        client: Optional[BleakClient] = None
+        try:
+            # BlueZ object cache first (no scan); scan only if BlueZ does not know the device
+            client_arg = await jk_ble_read.resolve_device(dev.address, dev.adapter, 0.0)
+            client = BleakClient(client_arg, timeout=self.timeout_s, adapter=dev.adapter)
+            try:
+                await _with_ble_lock(client.connect, timeout_s=lock_s)
+            except exc.BleakDeviceNotFoundError:
+                if self.scan_timeout_s <= 0:
+                    raise
+                client_arg = await jk_ble_read.resolve_device(dev.address, dev.adapter, self.scan_timeout_s)
+                client = BleakClient(client_arg, timeout=self.timeout_s, adapter=dev.adapter)
+                await _with_ble_lock(client.connect, timeout_s=lock_s)
+            # 300-byte answers span ~15 notifications: ask for a short interval (best-effort)
+            await request_fast_connection(client)
+            session = jk_ble_read.JKDeviceSession(client)
+            # StartNotify once per connection; polls only write the two requests from here on
+            await _with_ble_lock(session.start, timeout_s=lock_s)
+        except BaseException:
+            self._backoff[dev.name] = min(delay * 2.0, 5.0) if delay else 0.5
+            if client is not None:
+                try:
+                    await client.disconnect()
+                except Exception:
+                    pass
+            raise
+        self._backoff.pop(dev.name, None)
+        self._sessions[dev.name] = session
+        return session
+
+    async def _read_async(self, dev: DeviceCfg) -> Dict[str, Any]:
+        out = _read_envelope(dev)
+        lock = self._dev_locks.get(dev.name)
+        if lock is None:
+            lock = self._dev_locks[dev.name] = asyncio.Lock()
+
+        async def _do() -> None:
+            session = await self._get_session(dev)
+            await session.poll(self.timeout_s, out)
+            out["connected"] = bool(session.client.is_connected)
+            if not self.keep_connected:
+                # leave the BMS free for writers between polls
+                await session.stop()
+                await self._drop_session(dev.name)
+
+        async with lock:
+            # Overall safety timeout: connect + request window + scanning can hang when BlueZ is unhappy.
+            try:
+                await asyncio.wait_for(_do(), timeout=2 * self.timeout_s + self.scan_timeout_s + 10.0)
+            except Exception as e:
+                out["error"] = {"type": e.__class__.__name__, "message": str(e)}
+                # next poll starts from a fresh connection
+                await self._drop_session(dev.name)
+        return out
+
+    def _forget_session(self, name: str) -> None:
+        # new address/adapter: earlier connect failures say nothing about it
+        self._backoff.pop(name, None)
+        if self._loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._drop_session(name), self._loop).result(timeout=10.0)
+        except Exception:
+            pass
+
+    async def _read_many(self, devs: list[DeviceCfg], results: Dict[str, Dict[str, Any]]) -> None:
+        # Devices on different adapters do not contend in BlueZ: read the adapter groups
+        # concurrently, the devices of one adapter one after another.
+        # (adapter None = BlueZ default adapter, its own group)
+        groups: Dict[Optional[str], list[DeviceCfg]] = {}
+        for dev in devs:
+            groups.setdefault(dev.adapter, []).append(dev)
+
+        async def read_group(group: list[DeviceCfg]) -> None:
+            for dev in group:
+                results[dev.name] = await self._read_async(dev)
+
+        await asyncio.gather(*(read_group(g) for g in groups.values()))
+
+    def _read(self, devs: list[DeviceCfg]) -> Dict[str, Dict[str, Any]]:
+        """Read `devs` on the BLE loop; returns name -> payload for every device."""
+        assert self._loop is not None
+        results: Dict[str, Dict[str, Any]] = {}
+        fut = asyncio.run_coroutine_threadsafe(self._read_many(devs, results), self._loop)
+        per_adapter: Dict[Optional[str], int] = {}
+        for dev in devs:
+            per_adapter[dev.adapter] = per_adapter.get(dev.adapter, 0) + 1
+        # _read_async bounds each device; this only guards against a wedged loop.
+        # The longest adapter group bounds the whole pass.
+        wait_s = max(per_adapter.values(), default=1) * (2 * self.timeout_s + self.scan_timeout_s + 20.0)
+        try:
+            fut.result(timeout=wait_s)
+        except Exception as e:
+            fut.cancel()
+            # devices that finished before the failure keep their results
+            for dev in devs:
+                if dev.name not in results:
+                    out = _read_envelope(dev)
+                    out["error"] = {"type": e.__class__.__name__, "message": str(e) or "BLE loop did not answer"}
+                    results[dev.name] = out
+        return results
+
     def connect(self) -> None:
+        self._start_ble_loop()
         self._client.connect(self.mqtt_host, self.mqtt_port, keepalive=30)
         self._client.loop_start()
 
     def close(self) -> None:
         self._stop.set()
+        self._stop_ble_loop()
         try:
             self._client.loop_stop()
         except Exception:
@@ -252,7 +424,12 @@ class Gateway:
 
         self.connect()
         try:
+            # next_poll holds each device's deadline; the heap orders (deadline, name) so the
+            # next due device is heap[0]. Rescheduling pushes a new entry, older ones for the
+            # same device go stale (deadline != next_poll[name]) and are dropped when popped.
             next_poll = {d.name: 0.0 for d in self.devices}
+            heap: list[tuple[float, str]] = [(0.0, d.name) for d in self.devices]
+            by_name = {d.name: d for d in self.devices}
             while not self._stop.is_set():
                 now = _now()
 
@@ -262,11 +439,20 @@ class Gateway:
                         name, action, payload = self._cmdq.get_nowait()
                         if action == "read":
                             next_poll[name] = 0.0
+                            heapq.heappush(heap, (0.0, name))
+                        elif action == "release" and isinstance(payload, dict):
+                            # hand the BMS to a writer: disconnect now, next poll after the pause
+                            # (cmd/read ends the pause early)
+                            self._forget_session(name)
+                            t = now + float(payload.get("seconds") or 0.0)
+                            next_poll[name] = t
+                            heapq.heappush(heap, (t, name))
                         elif action == "config" and isinstance(payload, dict):
                             # per-device updates
                             for dev in self.devices:
                                 if dev.name != name:
                                     continue
+                                prev = (dev.address, dev.adapter)
                                 if payload.get("address"):
                                     dev.address = str(payload["address"]).strip()
                                 if "adapter" in payload:
@@ -274,12 +460,12 @@ class Gateway:
                                     a = None if a is None or str(a).strip() == "" else str(a).strip()
                                     if a is None or (a.startswith("hci") and a[3:].isdigit()):
                                         dev.adapter = a
-                                self._publish_json(
-                                    self._t(dev, "meta"),
-                                    {"name": dev.name, "address": dev.address, "adapter": dev.adapter, "ts": _now()},
-                                    retain=True,
-                                )
+                                if (dev.address, dev.adapter) != prev:
+                                    # the open connection belongs to the old address/adapter
+                                    self._forget_session(dev.name)
+                                self._client.publish(self._t(dev, "meta"), self._meta_payload(dev), qos=1, retain=True)
                                 next_poll[name] = 0.0
+                                heapq.heappush(heap, (0.0, name))
 
                             # global updates
                             if "poll_interval_s" in payload:
@@ -303,37 +489,48 @@ class Gateway:
                                         self.scan_timeout_s = v
                                 except Exception:
                                     pass
+                            if "keep_connected" in payload:
+                                self.keep_connected = bool(payload["keep_connected"])
+                                if not self.keep_connected:
+                                    for dev in self.devices:
+                                        self._forget_session(dev.name)
 
                             self._save_cfg()
                 except queue.Empty:
                     pass
 
-                did_work = False
-                for dev in self.devices:
-                    if now < next_poll.get(dev.name, 0.0):
+                due: list[DeviceCfg] = []
+                while heap and heap[0][0] <= now:
+                    t, name = heapq.heappop(heap)
+                    if t != next_poll.get(name) or name not in by_name:
                         continue
-                    did_work = True
-                    next_poll[dev.name] = now + self.poll_interval_s
-
-                    payload = _run_read(
-                        python=self.python,
-                        address=dev.address,
-                        adapter=dev.adapter,
-                        timeout_s=self.timeout_s,
-                        scan_timeout_s=self.scan_timeout_s,
-                    )
-
+                    next_poll[name] = t = now + self.poll_interval_s
+                    heapq.heappush(heap, (t, name))
+                    due.append(by_name[name])
+
+                # read every due device first (adapters in parallel), then hand all
+                # results to paho in one run
+                batch: list[tuple[str, bytes, int, bool]] = []
+                payloads = self._read(due) if due else {}
+                for dev in due:
+                    payload = payloads[dev.name]
                     ok = bool(payload.get("connected")) and not payload.get("error")
-                    self._publish_json(self._t(dev, "raw"), payload, retain=False)
-                    self._client.publish(self._t(dev, "online"), payload=("true" if ok else "false"), qos=1, retain=True)
-
-                if not did_work:
-                    time.sleep(0.1)
+                    # raw is re-sent every poll and not retained: QoS 0, no PUBACK round trip
+                    batch.append((self._t(dev, "raw"), _dumps(payload), 0, False))
+                    batch.append((self._t(dev, "online"), _ONLINE_TRUE if ok else _ONLINE_FALSE, 1, True))
+                self._flush_batch(batch)
+
+                # sleep until the next device is due or a command arrives
+                while heap and heap[0][0] != next_poll.get(heap[0][1]):
+                    heapq.heappop(heap)
+                next_deadline = heap[0][0] if heap else now + self.poll_interval_s
+                self._wake.wait(timeout=max(0.0, next_deadline - _now()))
+                self._wake.clear()
         finally:
             # Mark offline on exit
             for dev in self.devices:
                 try:
-                    self._client.publish(self._t(dev, "online"), payload="false", qos=1, retain=True)
+                    self._client.publish(self._t(dev, "online"), payload=_ONLINE_FALSE, qos=1, retain=True)
                 except Exception:
                     pass
             self.close()
@@ -343,13 +540,11 @@ class Gateway:
 def main() -> int:
     ap = argparse.ArgumentParser()
     ap.add_argument("--config", required=True, help="Path to jk_ble_gateway.json")
-    ap.add_argument("--python", default=None, help="Python interpreter to use for jk_ble_read.py")
+    ap.add_argument("--python", default=None, help="(ignored, reads run in-process)")
     args = ap.parse_args()
 
     cfg = _load_json(args.config)
-    python = args.python or _env_default("JK_GATEWAY_PYTHON", sys.executable) or sys.executable
-
-    gw = Gateway(cfg, python=python, config_path=args.config)
+    gw = Gateway(cfg, config_path=args.config)
     return gw.run()
 
 
@@ -11,7 +11,7 @@ This is based on the logic used in Louisvdw/dbus-serialbattery:
 import argparse
 import asyncio
 import time
-from struct import unpack_from
+from struct import Struct
 from bleak import BleakClient, exc
 
 CHAR_UUID = "0000ffe1-0000-1000-8000-00805f9b34fb"
@@ -23,14 +23,12 @@ CMD_DEVICE_INFO = 0x97
 
 MIN_RESPONSE_SIZE = 300
 MAX_RESPONSE_SIZE = 320
+FRAME_HEADER = b"\x55\xAA\xEB\x90"
 
 
 def crc_simple(arr: bytearray, length: int) -> int:
-    c = 0
-    for a in arr[:length]:
-        c += a
-    # little endian, low byte
-    return c.to_bytes(2, "little")[0]
+    # low byte of the byte sum; sum() over a memoryview slice runs in C and copies nothing
+    return sum(memoryview(arr)[:length]) & 0xFF
 
 
 def build_request_frame(cmd: int) -> bytearray:
@@ -46,28 +44,41 @@ def build_request_frame(cmd: int) -> bytearray:
     return frame
 
 
+# only two requests are ever sent: build them once
+FRAME_CELL = bytes(build_request_frame(CMD_CELL_INFO))
+FRAME_DEVICE = bytes(build_request_frame(CMD_DEVICE_INFO))
+
+
 class Assembler:
     def __init__(self):
-        self.buf = bytearray()
+        # reused across frames, filled at a cursor (bytes past `fill` are stale)
+        self.buf = bytearray(MAX_RESPONSE_SIZE)
+        self.fill = 0
         self.last_good = None  # (info_type, buf)
 
     def feed(self, data: bytearray):
-        if len(self.buf) > MAX_RESPONSE_SIZE:
-            self.buf = bytearray()
+        n = self.fill
+        if n > MAX_RESPONSE_SIZE:
+            n = 0
 
         # Start of new frame marker (per dbus-serialbattery)
-        if len(data) >= 4 and data[0:4] == b"\x55\xAA\xEB\x90":
-            self.buf = bytearray()
-
-        self.buf.extend(data)
-
-        if len(self.buf) >= MIN_RESPONSE_SIZE:
-            calc = crc_simple(self.buf, MIN_RESPONSE_SIZE - 1)
-            rx = self.buf[MIN_RESPONSE_SIZE - 1]
+        if data.startswith(FRAME_HEADER):
+            n = 0
+
+        buf = self.buf
+        end = n + len(data)
+        buf[n:end] = data
+        self.fill = end
+
+        # check (and decode) once, when the frame completes: the first 300 bytes do not
+        # change while trailing notifications are appended, neither does their CRC
+        if n < MIN_RESPONSE_SIZE <= end:
+            calc = crc_simple(buf, MIN_RESPONSE_SIZE - 1)
+            rx = buf[MIN_RESPONSE_SIZE - 1]
             if calc == rx:
-                info_type = self.buf[4]
-                self.last_good = (info_type, bytes(self.buf[:MIN_RESPONSE_SIZE]))
-                self.buf = bytearray()
+                info_type = buf[4]
+                self.last_good = (info_type, bytes(memoryview(buf)[:MIN_RESPONSE_SIZE]))
+                self.fill = 0
                 return self.last_good
         return None
 
@@ -88,19 +99,25 @@ def decode_device_info(frame300: bytes) -> dict:
     }
 
 
+_U_H = Struct("<H")
+_U_l = Struct("<l")
+# n -> Struct("<nH") for the cell voltage block
+_CELL_STRUCTS: dict = {}
+
+
 def decode_cell_info(frame300: bytes, max_cells: int = 32) -> dict:
     # The dbus-serialbattery tables are more complete; here we just decode core values.
-    total_v = unpack_from("<H", frame300, 118)[0] * 0.001
-    current_a = unpack_from("<l", frame300, 126)[0] * 0.001
+    total_v = _U_H.unpack_from(frame300, 118)[0] * 0.001
+    current_a = _U_l.unpack_from(frame300, 126)[0] * 0.001
     soc = frame300[141]
-    voltages = []
     # cell voltages from offset 6, <H, 0.001, count unknown here; decode up to max_cells
-    for i in range(max_cells):
-        mv = unpack_from("<H", frame300, 6 + i * 2)[0] * 0.001
-        voltages.append(mv)
-    # trim trailing zeros (common when max_cells > actual)
-    while voltages and voltages[-1] == 0.0:
-        voltages.pop()
+    # and drop trailing zero cells (common when max_cells > actual): rstrip finds the last
+    # non-zero byte in C, a half-stripped cell (high byte 0) still counts
+    n = (len(frame300[6 : 6 + 2 * max_cells].rstrip(b"\0")) + 1) // 2
+    st = _CELL_STRUCTS.get(n)
+    if st is None:
+        st = _CELL_STRUCTS[n] = Struct(f"<{n}H")
+    voltages = [mv * 0.001 for mv in st.unpack_from(frame300, 6)]
     return {"total_voltage_v": total_v, "current_a": current_a, "soc_pct": soc, "cell_voltages_v": voltages}
 
 
@@ -125,6 +142,8 @@ async def main():
                 except Exception:
                     got["model_nbr"] = None
 
+                done = asyncio.Event()
+
                 async def ncb(sender: int, data: bytearray):
                     res = asm.feed(data)
                     if res is None:
@@ -134,6 +153,8 @@ async def main():
                         got["device_info"] = decode_device_info(fr)
                     elif info_type == 0x02 and got["cell_info"] is None:
                         got["cell_info"] = decode_cell_info(fr)
+                    if got["device_info"] is not None and got["cell_info"] is not None:
+                        done.set()
 
                 # start notify (UUID -> fallback handle)
                 try:
@@ -144,12 +165,15 @@ async def main():
                     write_target = CHAR_HANDLE_FAILOVER
 
                 # send requests
-                await client.write_gatt_char(write_target, build_request_frame(CMD_DEVICE_INFO), response=False)
+                await client.write_gatt_char(write_target, FRAME_DEVICE, response=False)
                 await asyncio.sleep(0.2)
-                await client.write_gatt_char(write_target, build_request_frame(CMD_CELL_INFO), response=False)
+                await client.write_gatt_char(write_target, FRAME_CELL, response=False)
 
-                while time.time() < t_end and (got["device_info"] is None or got["cell_info"] is None):
-                    await asyncio.sleep(0.05)
+                # woken by ncb on the last frame, no poll ticks
+                try:
+                    await asyncio.wait_for(done.wait(), timeout=max(0.0, t_end - time.time()))
+                except asyncio.TimeoutError:
+                    pass
 
                 try:
                     await client.stop_notify(write_target)
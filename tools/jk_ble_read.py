@@ -15,11 +15,11 @@ import asyncio
 import json
 import time
 import traceback
-from struct import unpack_from, calcsize
+from struct import Struct
 
 from bleak import BleakClient, BleakScanner, exc
-from bleak.backends.device import BLEDevice
-from bleak.backends.bluezdbus.manager import get_global_bluez_manager
+
+from _ble_cache import ble_device_from_bluez_cache, request_fast_connection
 
 CHAR_UUID = "0000ffe1-0000-1000-8000-00805f9b34fb"
 CHAR_HANDLE_FAILOVER = 4
@@ -33,6 +33,8 @@ protocol_version = PROTOCOL_VERSION_JK02
 
 MIN_RESPONSE_SIZE = 300
 MAX_RESPONSE_SIZE = 320
+# every response starts with this marker; bytearray.startswith() compares it without a slice
+FRAME_HEADER = b"\x55\xAA\xEB\x90"
 
 
 TRANSLATE_DEVICE_INFO = [
@@ -111,10 +113,8 @@ TRANSLATE_CELL_INFO_32S = [
 
 
 def crc_simple(arr: bytearray, length: int) -> int:
-    c = 0
-    for a in arr[:length]:
-        c += a
-    return c.to_bytes(2, "little")[0]
+    # low byte of the byte sum; sum() over a memoryview slice runs in C and copies nothing
+    return sum(memoryview(arr)[:length]) & 0xFF
 
 
 def build_request_frame(cmd: int) -> bytearray:
@@ -129,18 +129,131 @@ def build_request_frame(cmd: int) -> bytearray:
     return frame
 
 
+# only two requests are ever sent: build them once
+FRAME_CELL = bytes(build_request_frame(COMMAND_CELL_INFO))
+FRAME_DEVICE = bytes(build_request_frame(COMMAND_DEVICE_INFO))
+
+
+def _clean_str(b: bytes) -> str:
+    try:
+        return b.decode("utf-8").rstrip(" \t\n\r\0")
+    except UnicodeDecodeError:
+        return ""
+
+
+# (id(table), f32s, cell count) -> generated decoder; the tables are module constants
+_DECODERS: dict = {}
+
+
+def _compile_table(table: list, f32s: bool = False, count: int | None = None):
+    """
+    Turn a TRANSLATE_* table into one flat function `fn(fb, out)`.
+
+    Same result as walking the table field by field (offset shift for 32S frames, list
+    fields, string cleanup, scaling), but every offset, Struct and factor is resolved once
+    here instead of per field per frame. `count` overrides the length of the
+    voltages/resistances lists (the real cell count from the settings frame).
+    """
+    key = (id(table), f32s, count)
+    fn = _DECODERS.get(key)
+    if fn is not None:
+        return fn
+
+    env = {"_clean_str": _clean_str}
+    lines = ["def _decode(fb, o):"]
+    containers = {(): "o"}
+
+    def container(path: tuple, leaf_len: int | None) -> str:
+        # emit "cN = parent.get(k)" once per path prefix, creating it like the walker did
+        var = containers.get(path)
+        if var is not None:
+            return var
+        parent = container(path[:-1], None)
+        var = containers[path] = f"c{len(containers)}"
+        lines.append(f"    {var} = {parent}.get({path[-1]!r})")
+        lines.append(f"    if {var} is None:")
+        init = f"[None] * {leaf_len}" if leaf_len is not None else "{}"
+        lines.append(f"        {var} = {parent}[{path[-1]!r}] = {init}")
+        return var
+
+    for t in table:
+        keys, base, fmt = t[0], t[1], t[2]
+        factor = t[3] if len(t) == 4 else None
+        leaf = keys[-1]
+        n = leaf if isinstance(leaf, int) else None
+        if n is not None and count is not None and len(keys) >= 3 and keys[-2] in ("voltages", "resistances"):
+            n = count
+        parent_path = tuple(keys[:-1])
+        var = container(parent_path, n)
+
+        offset = 0
+        if f32s:
+            if base >= 112:
+                offset = 32
+            elif base >= 54:
+                offset = 16
+
+        if isinstance(fmt, int):
+            size = fmt
+        else:
+            st = Struct(fmt)
+            size = st.size
+            sname = f"_s{len(env)}"
+            env[sname] = st.unpack_from
+            sample = st.unpack_from(bytes(size))[0]
+
+        targets = [repr(leaf)] if n is None else [str(j) for j in range(n)]
+        for step, target in enumerate(targets):
+            pos = base + offset + step * size
+            if isinstance(fmt, int):
+                # raw bytes field: slicing the bytearray frame buffer is already the one copy
+                expr = f"fb[{pos}:{pos + size}]"
+            elif isinstance(sample, bytes):
+                expr = f"_clean_str({sname}(fb, {pos})[0])"
+            elif isinstance(sample, int) and factor is not None:
+                expr = f"{sname}(fb, {pos})[0] * {factor!r}"
+            else:
+                expr = f"{sname}(fb, {pos})[0]"
+            lines.append(f"    {var}[{target}] = {expr}")
+
+    exec("\n".join(lines), env)
+    fn = _DECODERS[key] = env["_decode"]
+    return fn
+
+
+_S_WARNINGS = Struct("<H")
+# error bitmask (offset 136) bit -> warnings key, in output order
+_WARN_BITS = (
+    ("resistance_too_high", 0),
+    ("cell_count_wrong", 2),
+    ("charge_overtemp", 8),
+    ("charge_undertemp", 9),
+    ("discharge_overtemp", 15),
+    ("cell_overvoltage", 4),
+    ("cell_undervoltage", 11),
+    ("charge_overcurrent", 6),
+    ("discharge_overcurrent", 13),
+)
+_WARN_NONE = {name: False for name, _ in _WARN_BITS}
+
+
 class JKDecoder:
     def __init__(self):
-        self.frame_buffer = bytearray()
+        # reused across frames: notifications are written at the fill cursor instead of
+        # growing a fresh bytearray per response; bytes past frame_fill are stale
+        self.frame_buffer = bytearray(MAX_RESPONSE_SIZE)
+        self.frame_fill = 0
         self.bms_status = {"last_update": None}
         self.waiting_for = ""
         self.last_cell_info = 0
         self.bms_max_cell_count = None
         self.translate_cell_info = []
+        # real cell count from the settings frame; sizes the voltages/resistances lists
+        self.cell_count = None
 
     def get_bms_max_cell_count(self):
         fb = self.frame_buffer
-        if len(fb) < 292:
+        if self.frame_fill < 292:
             self.bms_max_cell_count = 24
             self.translate_cell_info = TRANSLATE_CELL_INFO_24S
             return
@@ -151,81 +264,36 @@ class JKDecoder:
             self.bms_max_cell_count = 24
             self.translate_cell_info = TRANSLATE_CELL_INFO_24S
 
-    def translate(self, fb, translation, o, f32s=False, i=0):
-        if i == len(translation[0]) - 1:
-            keys = range(0, translation[0][i]) if isinstance(translation[0][i], int) else [translation[0][i]]
-            offset = 0
-            if f32s:
-                if translation[1] >= 112:
-                    offset = 32
-                elif translation[1] >= 54:
-                    offset = 16
-            step = 0
-            for j in keys:
-                if isinstance(translation[2], int):
-                    val = bytearray(fb[translation[1] + step + offset : translation[1] + step + translation[2] + offset])
-                    step += translation[2]
-                else:
-                    val = unpack_from(translation[2], bytearray(fb), translation[1] + step + offset)[0]
-                    step += calcsize(translation[2])
-
-                if isinstance(val, bytes):
-                    try:
-                        val = val.decode("utf-8").rstrip(" \t\n\r\0")
-                    except UnicodeDecodeError:
-                        val = ""
-                elif isinstance(val, int) and len(translation) == 4:
-                    val = val * translation[3]
-                o[j] = val
-        else:
-            k = translation[0][i]
-            if k not in o:
-                if len(translation[0]) == i + 2 and isinstance(translation[0][i + 1], int):
-                    o[k] = [None] * translation[0][i + 1]
-                else:
-                    o[k] = {}
-            self.translate(fb, translation, o[k], f32s=f32s, i=i + 1)
-
     def decode_warnings(self, fb):
-        val = unpack_from("<H", bytearray(fb), 136)[0]
+        val = _S_WARNINGS.unpack_from(fb, 136)[0]
         self.bms_status.setdefault("cell_info", {})
         self.bms_status["cell_info"]["error_bitmask_16"] = hex(val)
         self.bms_status["cell_info"]["error_bitmask_2"] = format(val, "016b")
         w = self.bms_status.setdefault("warnings", {})
-        w["resistance_too_high"] = bool(val & (1 << 0))
-        w["cell_count_wrong"] = bool(val & (1 << 2))
-        w["charge_overtemp"] = bool(val & (1 << 8))
-        w["charge_undertemp"] = bool(val & (1 << 9))
-        w["discharge_overtemp"] = bool(val & (1 << 15))
-        w["cell_overvoltage"] = bool(val & (1 << 4))
-        w["cell_undervoltage"] = bool(val & (1 << 11))
-        w["charge_overcurrent"] = bool(val & (1 << 6))
-        w["discharge_overcurrent"] = bool(val & (1 << 13))
+        if val == 0:
+            # the usual case: no warning bit set
+            w.update(_WARN_NONE)
+        else:
+            w.update({name: bool(val >> bit & 1) for name, bit in _WARN_BITS})
 
     def decode_device_info(self):
-        fb = self.frame_buffer
-        for t in TRANSLATE_DEVICE_INFO:
-            self.translate(fb, t, self.bms_status)
+        _compile_table(TRANSLATE_DEVICE_INFO)(self.frame_buffer, self.bms_status)
 
     def decode_settings(self):
-        fb = self.frame_buffer
-        for t in TRANSLATE_SETTINGS:
-            self.translate(fb, t, self.bms_status)
+        _compile_table(TRANSLATE_SETTINGS)(self.frame_buffer, self.bms_status)
 
         # adapt translation for real cell_count if present
         try:
             ccount = int(self.bms_status["settings"]["cell_count"])
-            for i, t in enumerate(self.translate_cell_info):
-                if len(t[0]) >= 3 and t[0][-2] in ("voltages", "resistances"):
-                    self.translate_cell_info[i][0][-1] = ccount
+            if 0 < ccount <= 32:
+                self.cell_count = ccount
         except Exception:
             pass
 
     def decode_cell_info(self):
         fb = self.frame_buffer
         has32s = self.bms_max_cell_count == 32
-        for t in self.translate_cell_info:
-            self.translate(fb, t, self.bms_status, f32s=has32s)
+        _compile_table(self.translate_cell_info, f32s=has32s, count=self.cell_count)(fb, self.bms_status)
         self.decode_warnings(fb)
 
         # Derived convenience: power
@@ -249,17 +317,23 @@ class JKDecoder:
             pass
 
     def assemble_and_maybe_decode(self, data: bytearray):
-        if len(self.frame_buffer) > MAX_RESPONSE_SIZE:
-            self.frame_buffer = bytearray()
-
-        if len(data) >= 4 and data[0:4] == b"\x55\xAA\xEB\x90":
-            self.frame_buffer = bytearray()
+        n = self.frame_fill
+        if n > MAX_RESPONSE_SIZE:
+            n = 0
 
-        self.frame_buffer.extend(data)
+        if data.startswith(FRAME_HEADER):
+            n = 0
 
-        if len(self.frame_buffer) >= MIN_RESPONSE_SIZE:
-            calc = crc_simple(self.frame_buffer, MIN_RESPONSE_SIZE - 1)
-            rx = self.frame_buffer[MIN_RESPONSE_SIZE - 1]
+        fb = self.frame_buffer
+        end = n + len(data)
+        fb[n:end] = data  # grows the buffer only if a notification overruns it
+        self.frame_fill = end
+
+        # check (and decode) once, when the frame completes: the first 300 bytes do not
+        # change while trailing notifications are appended, neither does their CRC
+        if n < MIN_RESPONSE_SIZE <= end:
+            calc = crc_simple(fb, MIN_RESPONSE_SIZE - 1)
+            rx = fb[MIN_RESPONSE_SIZE - 1]
             if calc != rx:
                 return None
 
@@ -287,67 +361,173 @@ class JKDecoder:
         return None
 
 
-async def _ble_device_from_bluez_cache(address: str, adapter: str | None) -> BLEDevice | None:
-    """
-    Avoid scan-based device resolution when BlueZ already knows the device.
-    Many JK BLE modules stop advertising when connected/busy; Bleak's default
-    connect path scans to resolve a device path and can fail in that case.
-    """
-    try:
-        mgr = await get_global_bluez_manager()
-        await mgr.async_init()
-    except Exception:
-        return None
-
-    want_addr = (address or "").strip().upper()
-    if not want_addr:
-        return None
+async def resolve_device(address: str, adapter: str | None, scan_timeout: float):
+    """BLEDevice from the BlueZ cache (or a scan as fallback); the plain address if neither finds it."""
+    dev = await ble_device_from_bluez_cache(address, adapter)
+    if dev is None and scan_timeout > 0:
+        try:
+            dev = await BleakScanner.find_device_by_address(address, timeout=float(scan_timeout), adapter=adapter)
+        except TypeError:
+            dev = await BleakScanner.find_device_by_address(address, timeout=float(scan_timeout))
+    return dev if dev is not None else address
 
-    adapter_prefix = None
-    if adapter:
-        a = str(adapter).strip()
-        if a:
-            adapter_prefix = f"/org/bluez/{a}/"
 
-    try:
-        props = getattr(mgr, "_properties", {}) or {}
-    except Exception:
-        return None
+class JKDeviceSession:
+    """
+    One JK BMS on a connected BleakClient. Notifications are enabled once (start());
+    each poll() only writes the two requests and waits for the answers, so a long-lived
+    session (jk_ble_mqtt_gateway.py) pays connect/service discovery/StartNotify once.
+    """
 
-    for path, ifaces in props.items():
+    def __init__(self, client: BleakClient) -> None:
+        self.client = client
+        self.dec = JKDecoder()
+        self.model_nbr = None
+        self.write_target = None
+        # per poll: which answers arrived; `done` is set once device + cell info are in
+        self.got = {"device_info": False, "cell_info": False, "settings": False}
+        self.done = asyncio.Event()
+
+    def on_notify(self, sender: int, data: bytearray) -> None:
+        kind = self.dec.assemble_and_maybe_decode(data)
+        got = self.got
+        if kind in got:
+            got[kind] = True
+            if got["device_info"] and got["cell_info"]:
+                self.done.set()
+
+    async def start(self) -> None:
+        """Read the model number and enable notifications; raises the last error if that fails."""
+        if self.write_target is not None:
+            return
         try:
-            dev1 = (ifaces or {}).get("org.bluez.Device1") or {}
-            addr = str(dev1.get("Address") or "").strip().upper()
-            if addr != want_addr:
-                continue
-            if adapter_prefix and not str(path).startswith(adapter_prefix):
-                continue
-            name = dev1.get("Name") or dev1.get("Alias") or None
-            return BLEDevice(address=want_addr, name=name, details={"path": path, "props": dev1})
+            self.model_nbr = (
+                (await self.client.read_gatt_char(MODEL_NBR_UUID)).decode("utf-8", errors="ignore").strip()
+            )
         except Exception:
-            continue
+            self.model_nbr = None
+
+        # notify setup
+        #
+        # On BlueZ it's possible to hit transient errors like:
+        # - org.bluez.Error.NotPermitted: Notify acquired
+        # - org.bluez.Error.InProgress / Operation already in progress
+        #
+        # Retrying the UUID is more reliable than falling back to a numeric handle.
+        # The characteristic object (if discovered) spares bleak the UUID lookup on every
+        # write of the session.
+        try:
+            target = self.client.services.get_characteristic(CHAR_UUID) or CHAR_UUID
+        except Exception:
+            target = CHAR_UUID
+        last_err = None
+        for _ in range(3):
+            try:
+                await self.client.start_notify(target, self.on_notify)
+                self.write_target = target
+                return
+            except Exception as e1:
+                last_err = e1
+                await asyncio.sleep(0.6)
+        raise last_err
+
+    async def stop(self) -> None:
+        if self.write_target is None:
+            return
+        try:
+            await self.client.stop_notify(self.write_target)
+        except Exception:
+            pass
+        self.write_target = None
+
+    async def poll(self, timeout_s: float, out: dict) -> None:
+        """Request device + cell info and fill out["model_nbr"/"got"/"status"]."""
+        client = self.client
+        write_target = self.write_target
+        dec = self.dec
+        # fresh status per poll; it is detached from the decoder again before it is handed out
+        dec.bms_status = {"last_update": None}
+        got = self.got = {"device_info": False, "cell_info": False, "settings": False}
+        done = self.done
+        done.clear()
+        out["model_nbr"] = self.model_nbr
+        out["got"] = got
+
+        async def send_device():
+            await client.write_gatt_char(write_target, FRAME_DEVICE, response=False)
+
+        async def send_cell():
+            await client.write_gatt_char(write_target, FRAME_CELL, response=False)
+
+        # initial burst
+        await send_device()
+        await asyncio.sleep(0.2)
+        await send_cell()
+
+        # Some JK firmwares are flaky with one-off requests; retry until timeout.
+        t_end = time.time() + timeout_s
+        t_next_dev = time.time() + 2.0
+        t_next_cell = time.time() + 2.0
+        while not done.is_set():
+            now = time.time()
+            if now >= t_end:
+                break
+            if not got["device_info"] and now >= t_next_dev:
+                await send_device()
+                t_next_dev = now + 2.0
+            if not got["cell_info"] and now >= t_next_cell:
+                await send_cell()
+                t_next_cell = now + 2.0
+            # sleep until the next re-send is due, the deadline, or completion
+            wake = t_end
+            if not got["device_info"]:
+                wake = min(wake, t_next_dev)
+            if not got["cell_info"]:
+                wake = min(wake, t_next_cell)
+            try:
+                await asyncio.wait_for(done.wait(), timeout=max(0.0, wake - time.time()))
+            except asyncio.TimeoutError:
+                pass
+
+        # Notify stays registered between polls (late re-sent answers, JK keeps streaming cell
+        # info), so detach the status first: the caller serializes it on another thread, and
+        # the trimming below must not shorten lists the decoder still writes into.
+        status = dec.bms_status
+        dec.bms_status = {"last_update": None}
+        out["got"] = dict(got)
+
+        # Derivations for consumers (Node-RED/UI):
+        try:
+            ci = status.get("cell_info", {})
+            v = ci.get("voltages") or []
+            r = ci.get("resistances") or []
+            # cells are unsigned: everything but 0/None is a populated cell (list.count runs in C)
+            inferred = len(v) - v.count(0) - v.count(None)
+            if inferred:
+                ci["cell_count_inferred"] = inferred
+                ci["voltages"] = v[:inferred]
+                if r:
+                    ci["resistances"] = r[:inferred]
+        except Exception:
+            pass
 
-    return None
+        out["status"] = status
 
 
-async def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--address", required=True)
-    ap.add_argument("--timeout", type=float, default=20.0)
-    ap.add_argument("--adapter", default=None, help="BlueZ adapter name, e.g. hci1")
-    ap.add_argument(
-        "--scan-timeout",
-        type=float,
-        default=0.0,
-        help="Optional scan time on connect failures (helps when BlueZ cache is empty)",
-    )
-    ap.add_argument("--debug", action="store_true", help="Include traceback in JSON on error")
-    args = ap.parse_args()
-
-    dec = JKDecoder()
+async def read_once(
+    address: str,
+    adapter: str | None = None,
+    timeout_s: float = 20.0,
+    scan_timeout_s: float = 0.0,
+    debug: bool = False,
+) -> dict:
+    """
+    One connect/read/disconnect cycle; returns the JSON-ready payload dict and never raises.
+    Long-running callers keep a JKDeviceSession instead of calling this per poll.
+    """
     out = {
-        "address": args.address,
-        "adapter": args.adapter,
+        "address": address,
+        "adapter": adapter,
         "connected": False,
         "model_nbr": None,
         "got": {"device_info": False, "cell_info": False, "settings": False},
@@ -358,139 +538,81 @@ async def main():
     try:
         # Connect (optionally scan+retry on DeviceNotFound). Some JK BLE devices stop advertising when busy/connected.
         async def run_once(client: BleakClient):
-            try:
-                async with client:
-                    try:
-                        out["model_nbr"] = (
-                            (await client.read_gatt_char(MODEL_NBR_UUID))
-                            .decode("utf-8", errors="ignore")
-                            .strip()
-                        )
-                    except Exception:
-                        out["model_nbr"] = None
-
-                    got = out["got"]
-
-                    def ncb(sender: int, data: bytearray):
-                        kind = dec.assemble_and_maybe_decode(bytearray(data))
-                        if kind in got:
-                            got[kind] = True
-
-                    # notify setup
-                    #
-                    # On BlueZ it's possible to hit transient errors like:
-                    # - org.bluez.Error.NotPermitted: Notify acquired
-                    # - org.bluez.Error.InProgress / Operation already in progress
-                    #
-                    # Retrying the UUID is more reliable than falling back to a numeric handle.
-                    write_target = None
-                    last_err = None
-                    for _ in range(3):
-                        try:
-                            await client.start_notify(CHAR_UUID, ncb)
-                            write_target = CHAR_UUID
-                            last_err = None
-                            break
-                        except Exception as e1:
-                            last_err = e1
-                            await asyncio.sleep(0.6)
-                    if write_target is None:
-                        out["error"] = {"type": last_err.__class__.__name__, "message": str(last_err)}
-                        out["connected"] = bool(client.is_connected)
-                        out["status"] = dec.bms_status
-                        print(json.dumps(out, ensure_ascii=False))
-                        return 0
-
-                    async def send_device():
-                        await client.write_gatt_char(
-                            write_target, build_request_frame(COMMAND_DEVICE_INFO), response=False
-                        )
-
-                    async def send_cell():
-                        await client.write_gatt_char(
-                            write_target, build_request_frame(COMMAND_CELL_INFO), response=False
-                        )
-
-                    # initial burst
-                    await send_device()
-                    await asyncio.sleep(0.2)
-                    await send_cell()
-
-                    # Some JK firmwares are flaky with one-off requests; retry until timeout.
-                    t_end = time.time() + args.timeout
-                    t_next_dev = time.time() + 2.0
-                    t_next_cell = time.time() + 2.0
-                    while time.time() < t_end and not (got["device_info"] and got["cell_info"]):
-                        now = time.time()
-                        if not got["device_info"] and now >= t_next_dev:
-                            await send_device()
-                            t_next_dev = now + 2.0
-                        if not got["cell_info"] and now >= t_next_cell:
-                            await send_cell()
-                            t_next_cell = now + 2.0
-                        await asyncio.sleep(0.05)
-
-                    try:
-                        await client.stop_notify(write_target)
-                    except Exception:
-                        pass
+            async with client:
+                # 300-byte answers span ~15 notifications at the default MTU: ask for a
+                # short connection interval so they ride fewer connection events (best-effort)
+                await request_fast_connection(client)
+                session = JKDeviceSession(client)
+                try:
+                    await session.start()
+                except Exception as e1:
+                    out["model_nbr"] = session.model_nbr
+                    out["error"] = {"type": e1.__class__.__name__, "message": str(e1)}
+                    out["connected"] = bool(client.is_connected)
+                    out["status"] = session.dec.bms_status
+                    return out
 
-                    # Derivations for consumers (Node-RED/UI):
-                    try:
-                        ci = dec.bms_status.get("cell_info", {})
-                        v = ci.get("voltages") or []
-                        r = ci.get("resistances") or []
-                        inferred = 0
-                        for x in v:
-                            if x and x > 0:
-                                inferred += 1
-                        if inferred:
-                            ci["cell_count_inferred"] = inferred
-                            ci["voltages"] = v[:inferred]
-                            if r:
-                                ci["resistances"] = r[:inferred]
-                    except Exception:
-                        pass
+                await session.poll(timeout_s, out)
+                await session.stop()
 
-                    out["connected"] = bool(client.is_connected)
-                    out["status"] = dec.bms_status
-                    print(json.dumps(out, ensure_ascii=False))
-                    return 0
-            except Exception:
-                raise
+                out["connected"] = bool(client.is_connected)
+                return out
 
         try:
-            cached = await _ble_device_from_bluez_cache(args.address, args.adapter)
+            cached = await ble_device_from_bluez_cache(address, adapter)
             if cached is not None:
-                return await run_once(BleakClient(cached, timeout=args.timeout, adapter=args.adapter))
-            return await run_once(BleakClient(args.address, timeout=args.timeout, adapter=args.adapter))
+                return await run_once(BleakClient(cached, timeout=timeout_s, adapter=adapter))
+            return await run_once(BleakClient(address, timeout=timeout_s, adapter=adapter))
         except exc.BleakDeviceNotFoundError as e_nf:
-            scan_t = max(0.0, min(float(args.scan_timeout), float(args.timeout)))
+            scan_t = max(0.0, min(float(scan_timeout_s), float(timeout_s)))
             if scan_t > 0:
                 try:
                     try:
                         dev = await BleakScanner.find_device_by_address(
-                            args.address, timeout=scan_t, adapter=args.adapter
+                            address, timeout=scan_t, adapter=adapter
                         )
                     except TypeError:
-                        dev = await BleakScanner.find_device_by_address(args.address, timeout=scan_t)
+                        dev = await BleakScanner.find_device_by_address(address, timeout=scan_t)
                 except Exception:
                     dev = None
                 if dev is None:
                     out["error"] = {"type": e_nf.__class__.__name__, "message": str(e_nf)}
-                    print(json.dumps(out, ensure_ascii=False))
-                    return 0
+                    return out
             # Scan may not find a device that is connected/not advertising. Try cache lookup again.
-            cached = await _ble_device_from_bluez_cache(args.address, args.adapter)
+            cached = await ble_device_from_bluez_cache(address, adapter)
             if cached is not None:
-                return await run_once(BleakClient(cached, timeout=args.timeout, adapter=args.adapter))
-            return await run_once(BleakClient(args.address, timeout=args.timeout, adapter=args.adapter))
+                return await run_once(BleakClient(cached, timeout=timeout_s, adapter=adapter))
+            return await run_once(BleakClient(address, timeout=timeout_s, adapter=adapter))
     except Exception as e:
         out["error"] = {"type": e.__class__.__name__, "message": str(e)}
-        if args.debug:
+        if debug:
             out["traceback"] = traceback.format_exc()
-        print(json.dumps(out, ensure_ascii=False))
-        return 0
+        return out
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--address", required=True)
+    ap.add_argument("--timeout", type=float, default=20.0)
+    ap.add_argument("--adapter", default=None, help="BlueZ adapter name, e.g. hci1")
+    ap.add_argument(
+        "--scan-timeout",
+        type=float,
+        default=0.0,
+        help="Optional scan time on connect failures (helps when BlueZ cache is empty)",
+    )
+    ap.add_argument("--debug", action="store_true", help="Include traceback in JSON on error")
+    args = ap.parse_args()
+
+    out = await read_once(
+        args.address,
+        adapter=args.adapter,
+        timeout_s=args.timeout,
+        scan_timeout_s=args.scan_timeout,
+        debug=args.debug,
+    )
+    print(json.dumps(out, ensure_ascii=False))
+    return 0
 
 
 if __name__ == "__main__":
@@ -10,18 +10,47 @@ Implemented:
 WARNING:
 - Writes can permanently change BMS behavior.
 - Start with --dry-run and verify values.
+
+Timing: run time is set by the BLE link, not by Python. Each register is one 20 byte
+write-without-response, which goes on air at the next connection event, followed by a
+settle delay for the BMS to apply it (--settle-ms). Lowering the connection interval
+(BlueZ conn_min_interval/conn_max_interval) is the lever for the on-air part.
+
+Connect + service discovery usually cost more than the writes. If jk_ble_writed.py listens
+on --socket, the ops are handed to it and run on its kept-open connection; otherwise (or with
+--no-daemon) this script connects itself.
 """
 
 import argparse
 import asyncio
 import json
+import os
+import sys
 import time
+from functools import partial
+from struct import Struct
+from typing import Any, Optional
 
 from bleak import BleakClient
 
+from _ble_cache import FAST_CONN_PARAMS, request_fast_connection, set_debugfs_conn_interval, with_ble_lock
+
+try:
+    import orjson
+except ImportError:  # optional, stdlib json as fallback
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:  # optional, default asyncio loop as fallback
+    uvloop = None
+
 CHAR_UUID = "0000ffe1-0000-1000-8000-00805f9b34fb"
 CHAR_HANDLE_FAILOVER = 4
 
+# Unix socket of jk_ble_writed.py (systemd/jk-ble-writed.service creates /run/jk-ble-write)
+SOCKET_PATH = os.environ.get("JK_BLE_WRITE_SOCKET", "/run/jk-ble-write/jk_ble_write.sock")
+
 PROTO_JK02_24S = "jk02_24s"
 PROTO_JK02_32S = "jk02_32s"
 
@@ -64,52 +93,96 @@ SW = {
 }
 
 
+_U32 = Struct("<I")
+
+
+def _dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def _print_json(obj: Any) -> None:
+    sys.stdout.buffer.write(_dumps(obj) + b"\n")
+    sys.stdout.buffer.flush()
+
+
 def crc_simple(arr: bytearray, length: int) -> int:
-    c = 0
-    for a in arr[:length]:
-        c += a
-    return c.to_bytes(2, "little")[0]
+    # low byte of the byte sum; sum() over a memoryview slice runs in C and copies nothing
+    return sum(memoryview(arr)[:length]) & 0xFF
 
 
-def jk_float_to_hex_little(val: float) -> bytearray:
+def jk_float_to_hex_little(val: float) -> bytes:
     intval = int(round(val * 1000))
     intval = max(0, min(0xFFFFFFFF, intval))
-    hexval = f"{intval:0>8X}"
-    return bytearray.fromhex(hexval)[::-1]
+    return _U32.pack(intval)
+
+def u32_to_le_bytes(v: int) -> bytes:
+    return _U32.pack(int(v) & 0xFFFFFFFF)
+
+
+WRITE_FRAME_HEADER = b"\xAA\x55\x90\xEB"
 
-def u32_to_le_bytes(v: int) -> bytearray:
-    v = int(v) & 0xFFFFFFFF
-    return bytearray([v & 0xFF, (v >> 8) & 0xFF, (v >> 16) & 0xFF, (v >> 24) & 0xFF])
+# Write frame scratch: header AA 55 90 EB, reg, len, 4 value bytes, zero padding, CRC.
+# build_write_frame fills it and returns a copy; there is no await in between, so the
+# pipelined write tasks cannot interleave on it.
+_SCRATCH = bytearray(WRITE_FRAME_HEADER + bytes(16))
+# Header and padding never change, so the CRC (byte sum of 0..18) is this constant
+# plus reg, len and the value bytes.
+_HEADER_SUM = sum(WRITE_FRAME_HEADER)
 
 
-def build_write_frame(reg: int, vals4: bytearray, length: int) -> bytearray:
-    frame = bytearray(20)
-    frame[0] = 0xAA
-    frame[1] = 0x55
-    frame[2] = 0x90
-    frame[3] = 0xEB
-    frame[4] = reg & 0xFF
-    frame[5] = length & 0xFF
-    frame[6:10] = vals4[:4]
-    frame[19] = crc_simple(frame, 19)
-    return frame
+def build_write_frame(reg: int, vals4: bytes, length: int) -> bytes:
+    frame = _SCRATCH
+    reg &= 0xFF
+    length &= 0xFF
+    v4 = vals4[:4]
+    if len(v4) != 4:
+        v4 = bytes(v4).ljust(4, b"\0")
+    frame[4] = reg
+    frame[5] = length
+    frame[6:10] = v4
+    frame[19] = (_HEADER_SUM + reg + length + sum(v4)) & 0xFF
+    return bytes(frame)
 
 
-async def write_register(client: BleakClient, write_target, reg: int, vals4: bytearray, length: int, await_s: float = 0.0):
-    frame = build_write_frame(reg, vals4, length)
+async def write_register(client: BleakClient, write_target, reg: int, vals4: bytes, length: int, await_s: float = 0.0, frame=None):
+    if frame is None:
+        frame = build_write_frame(reg, vals4, length)
     await client.write_gatt_char(write_target, frame, response=False)
     if await_s > 0:
         await asyncio.sleep(await_s)
+    return _write_record(reg, vals4, length, frame)
+
+
+def _write_record(reg: int, vals4: bytes, length: int, frame) -> dict:
     return {"reg": reg, "len": length, "data": vals4[:length].hex(), "frame": frame.hex()}
 
 
+async def negotiated_mtu(client: BleakClient) -> int:
+    """
+    ATT MTU of the connection. BlueZ exchanges the MTU itself at connect; older bleak
+    versions only learn it through the backend's _acquire_mtu(). 23 (the minimum) if unknown.
+    """
+    acquire = getattr(getattr(client, "_backend", None), "_acquire_mtu", None)
+    if acquire is not None:
+        try:
+            await acquire()
+        except Exception:
+            pass
+    try:
+        return int(client.mtu_size)
+    except Exception:
+        return 23
+
+
 def pick_reg(proto: str, reg24, reg32):
     if proto == PROTO_JK02_32S:
         return reg32
     return reg24
 
 
-def build_number_write(proto: str, key: str, value: float) -> tuple[int, bytearray, int, dict]:
+def build_number_write(proto: str, key: str, value: float) -> tuple[int, bytes, int, dict]:
     if key not in NUM:
         raise KeyError(key)
     reg24, reg32, factor, length = NUM[key]
@@ -122,7 +195,7 @@ def build_number_write(proto: str, key: str, value: float) -> tuple[int, bytearr
     return reg, vals4, length, meta
 
 
-def build_switch_write(proto: str, key: str, state: bool) -> tuple[int, bytearray, int, dict]:
+def build_switch_write(proto: str, key: str, state: bool) -> tuple[int, bytes, int, dict]:
     if key not in SW:
         raise KeyError(key)
     reg24, reg32, length = SW[key]
@@ -134,6 +207,186 @@ def build_switch_write(proto: str, key: str, state: bool) -> tuple[int, bytearra
     return reg, vals4, length, meta
 
 
+# Switches only ever write 0 or 1: all their frames are built once at import.
+# (proto, key, state) -> 20 byte frame; keys not supported by a proto are left out.
+_SW_FRAME_CACHE: dict[tuple[str, str, bool], bytes] = {}
+for _proto in (PROTO_JK02_24S, PROTO_JK02_32S):
+    for _key in SW:
+        for _state in (False, True):
+            try:
+                _reg, _vals4, _length, _ = build_switch_write(_proto, _key, _state)
+            except ValueError:
+                continue
+            _SW_FRAME_CACHE[(_proto, _key, _state)] = bytes(build_write_frame(_reg, _vals4, _length))
+del _proto, _key, _state, _reg, _vals4, _length
+
+
+def resolve_write_target(client: BleakClient):
+    """
+    Pick the write characteristic once per connection from the discovered services:
+    the FFE1 characteristic object if present (saves bleak the UUID lookup per write),
+    else the numeric handle. Write errors then surface instead of being retried blindly.
+    """
+    try:
+        char = client.services.get_characteristic(CHAR_UUID)
+    except Exception:
+        char = None
+    return char if char is not None else CHAR_HANDLE_FAILOVER
+
+
+async def run_ops(client: BleakClient, ops, proto: str, args) -> list:
+    """
+    Apply planned ops [(op, key, value), ...] on a connected client, return the per-op results.
+    args needs settle_ms, pipeline_depth and max_cell_v (CLI namespace or jk_ble_writed request).
+    """
+    plan = plan_ops(proto, ops, args)
+    write_target = resolve_write_target(client)
+
+    # one write helper bound to this connection and its write target
+    wr = partial(write_register, client, write_target)
+
+    async def wr_many(writes, await_s=0.0):
+        # several frames back to back in one ATT PDU (--coalesce), settle as for a single write
+        if len(writes) == 1:
+            return [await wr(*writes[0][:3], await_s=await_s, frame=writes[0][3])]
+        await client.write_gatt_char(write_target, b"".join(w[3] for w in writes), response=False)
+        if await_s > 0:
+            await asyncio.sleep(await_s)
+        return [_write_record(*w) for w in writes]
+
+    # Frames per PDU: 1 unless --coalesce and the MTU leaves room for more (needs BMS
+    # firmware that parses concatenated frames from one write).
+    per_pdu = 1
+    if getattr(args, "coalesce", False):
+        per_pdu = max(1, (await negotiated_mtu(client) - 3) // len(_SCRATCH))
+
+    return await _run_plan(wr, wr_many, per_pdu, plan, args)
+
+
+def plan_ops(proto: str, ops, args) -> list:
+    """
+    Encode all ops up front: register lookup, value encoding and frame per write.
+    Returns [(kind, entry, writes)] with kind "write" or "soc_reset", entry the result dict
+    of the op and writes [(reg, vals4, length, frame), ...]. A bad op raises here, before
+    anything has been written.
+    """
+    plan = []
+    for op, key, val in ops:
+        if op == "num":
+            reg, vals4, length, meta = build_number_write(proto, key, val)
+            frame = build_write_frame(reg, vals4, length)
+            plan.append(("write", {"op": "set_number", **meta, "reg": reg}, [(reg, vals4, length, frame)]))
+        elif op == "sw":
+            reg, vals4, length, meta = build_switch_write(proto, key, val)
+            frame = _SW_FRAME_CACHE[(proto, key, bool(val))]
+            plan.append(("write", {"op": "set_switch", **meta, "reg": reg}, [(reg, vals4, length, frame)]))
+        elif op == "soc_reset":
+            if args.max_cell_v is None:
+                raise ValueError("soc_reset requires max_cell_v")
+            max_cell_v = float(args.max_cell_v)
+            ovp_trigger = round(max_cell_v - 0.05, 3)
+            ovpr_trigger = round(max_cell_v - 0.10, 3)
+            writes = []
+            for key, v in (("cell_ovpr_v", ovpr_trigger), ("cell_ovp_v", ovp_trigger)):
+                reg, vals4, length, _ = build_number_write(proto, key, v)
+                writes.append((reg, vals4, length, build_write_frame(reg, vals4, length)))
+            entry = {"op": "soc_reset", "max_cell_v": args.max_cell_v, "ovpr_trigger": ovpr_trigger, "ovp_trigger": ovp_trigger}
+            plan.append(("soc_reset", entry, writes))
+    return plan
+
+
+async def _run_plan(wr, wr_many, per_pdu: int, plan: list, args) -> list:
+    settle_s = max(0.0, float(args.settle_ms)) / 1000.0
+    # Without-response writes need no ack, so without a settle pause several can be handed
+    # to BlueZ at once and go out back to back, one per connection event. Tasks start in
+    # op order, so the frames leave in op order too.
+    sem = asyncio.Semaphore(max(1, int(args.pipeline_depth)) if settle_s == 0 else 1)
+    pending = []
+    batch = []
+
+    async def wr_nowait(steps):
+        async with sem:
+            recs = await wr_many([writes[0] for _, writes in steps], await_s=settle_s)
+            for (entry, _), rec in zip(steps, recs):
+                entry["write"] = rec
+
+    def submit():
+        if batch:
+            pending.append(asyncio.create_task(wr_nowait(batch[:])))
+            batch.clear()
+
+    async def drain():
+        # first failure wins: later queued writes must not go out after it, so cancel them
+        # and wait until they are gone before the error reaches the caller
+        try:
+            await asyncio.gather(*pending)
+        except BaseException:
+            for t in pending:
+                t.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            raise
+        finally:
+            pending.clear()
+
+    for kind, entry, writes in plan:
+        if kind == "write":
+            batch.append((entry, writes))
+            if len(batch) >= per_pdu:
+                submit()
+        else:
+            # soc_reset barrier: everything queued before must be written before the OVP sequence.
+            # Own timing, independent of --settle-ms and --coalesce: one frame per write with a
+            # fixed 0.5 s sleep each, so both thresholds are applied before the 5 s hold.
+            submit()
+            await drain()
+            entry["writes"] = [await wr(reg, vals4, length, await_s=0.5, frame=frame) for reg, vals4, length, frame in writes]
+            await asyncio.sleep(5)
+    submit()
+    await drain()
+    return [entry for _, entry, _ in plan]
+
+
+def request_timeout_s(timeout: float, settle_ms: float, ops) -> float:
+    """
+    Upper bound for one write request: connect + per-op settle, 5.5 s per soc_reset, plus
+    slack for discovery and BlueZ. Used by the CLI for the daemon reply and by the daemon itself.
+    """
+    settle_s = max(0.0, float(settle_ms)) / 1000.0
+    n_soc = sum(1 for op in ops if op[0] == "soc_reset")
+    return float(timeout) + len(ops) * (settle_s + 1.0) + n_soc * 6.0 + 10.0
+
+
+async def run_via_daemon(sock_path: str, req: dict, timeout_s: float) -> Optional[dict]:
+    """
+    Hand a request to jk_ble_writed.py, which keeps the BLE connection open between calls.
+    Returns None if no daemon listens on sock_path (caller connects itself), an error dict
+    if it does not answer within timeout_s, drops the connection or sends garbage (the ops
+    may be partly written by then).
+    """
+    try:
+        reader, writer = await asyncio.open_unix_connection(sock_path)
+    except (OSError, NotImplementedError):
+        return None
+    try:
+        writer.write(_dumps(req) + b"\n")
+        await writer.drain()
+        line = await asyncio.wait_for(reader.readline(), timeout=timeout_s)
+    except asyncio.TimeoutError:
+        return {"error": f"no response within {timeout_s:g} s"}
+    except (OSError, ValueError) as e:
+        # daemon restarted mid-request (reset/broken pipe) or an over-long line
+        return {"error": f"{type(e).__name__}: {e}"}
+    finally:
+        writer.close()
+    if not line.strip():
+        return {"error": "no response"}
+    try:
+        resp = json.loads(line)
+    except ValueError as e:
+        return {"error": f"invalid response: {e}"}
+    return resp if isinstance(resp, dict) else {"error": "invalid response"}
+
+
 async def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--address", required=True)
@@ -141,6 +394,25 @@ async def main():
     ap.add_argument("--adapter", default=None, help="BlueZ adapter name, e.g. hci1")
     ap.add_argument("--dry-run", action="store_true")
     ap.add_argument("--proto", default="auto", help="auto|jk02_24s|jk02_32s")
+    ap.add_argument("--settle-ms", type=float, default=400.0, help="Pause after each register write (0 = none)")
+    ap.add_argument(
+        "--coalesce",
+        action="store_true",
+        help="Send as many frames per BLE write as the MTU allows (BMS firmware must accept this)",
+    )
+    ap.add_argument(
+        "--fast-interval",
+        action="store_true",
+        help="Lower the adapter's connection interval via debugfs for this run (root only, restored on exit)",
+    )
+    ap.add_argument("--socket", default=SOCKET_PATH, help="jk_ble_writed.py socket (used when it listens)")
+    ap.add_argument("--no-daemon", action="store_true", help="Always connect directly, ignore jk_ble_writed.py")
+    ap.add_argument(
+        "--pipeline-depth",
+        type=int,
+        default=4,
+        help="Writes in flight at once with --settle-ms 0 (with a settle pause writes stay one by one)",
+    )
 
     # Numbers (cell-based voltages/currents)
     ap.add_argument("--set-uvp", type=float, default=None, help="Cell UVP in V")
@@ -217,53 +489,72 @@ async def main():
     planned = {"address": args.address, "adapter": args.adapter, "ops": ops, "dry_run": args.dry_run}
     if args.dry_run:
         planned["proto"] = proto
-        print(json.dumps({"planned": planned}, ensure_ascii=False))
+        _print_json({"planned": planned})
         return
 
     if not args.force:
         raise SystemExit("Refusing to write without --force (safety). Use --dry-run to inspect planned ops.")
 
+    if args.soc_reset and args.max_cell_v is None:
+        raise SystemExit("--soc-reset requires --max-cell-v (for now)")
+
     results = {"address": args.address, "adapter": args.adapter, "ts": time.time(), "ops": []}
+    await _write(args, proto, ops, results)
+    _print_json(results)
+
+
+async def _write(args, proto: str, ops, results: dict) -> None:
+    if not args.no_daemon:
+        resp = await run_via_daemon(
+            args.socket,
+            {
+                "address": args.address,
+                "adapter": args.adapter,
+                "timeout": args.timeout,
+                "proto": proto,
+                "ops": ops,
+                "settle_ms": args.settle_ms,
+                "pipeline_depth": args.pipeline_depth,
+                "max_cell_v": args.max_cell_v,
+                "coalesce": args.coalesce,
+            },
+            request_timeout_s(args.timeout, args.settle_ms, ops),
+        )
+        if resp is not None:
+            # the daemon may have written part of the ops already: no direct retry
+            if resp.get("error"):
+                raise SystemExit(f"jk_ble_writed: {resp['error']}")
+            if args.fast_interval:
+                print("--fast-interval: ignored, jk_ble_writed.py holds the connection (use --no-daemon)", file=sys.stderr)
+            results["ops"] = resp.get("ops") or []
+            results["proto"] = proto
+            return
 
-    async with BleakClient(args.address, timeout=args.timeout, adapter=args.adapter) as client:
-        # pick write characteristic
+    # debugfs only affects connections made afterwards, so it has to be in place before connecting
+    saved = None
+    if args.fast_interval:
+        saved = set_debugfs_conn_interval(args.adapter, *FAST_CONN_PARAMS[:2])
+        if saved is None:
+            print("--fast-interval: debugfs not writable (root? debugfs mounted?), keeping defaults", file=sys.stderr)
+    try:
+        client = BleakClient(args.address, timeout=args.timeout, adapter=args.adapter)
+        # same cross-process lock as the gateways and jk_ble_writed.py: no concurrent connects
+        await with_ble_lock(client.connect, timeout_s=max(30.0, args.timeout + 10.0))
         try:
-            # read properties by trying notify start is overkill; just try write UUID.
-            write_target = CHAR_UUID
-        except Exception:
-            write_target = CHAR_HANDLE_FAILOVER
-
-        # Determine which target works by attempting a harmless 0-length write? not possible.
-        # We'll try UUID first, fallback to handle on BleakError.
-        async def wr(reg, vals4, length, await_s=0.0):
-            try:
-                return await write_register(client, CHAR_UUID, reg, vals4, length, await_s=await_s)
-            except Exception:
-                return await write_register(client, CHAR_HANDLE_FAILOVER, reg, vals4, length, await_s=await_s)
-
-        results["proto"] = proto
-
-        for op, key, val in ops:
-            if op == "num":
-                reg, vals4, length, meta = build_number_write(proto, key, val)
-                results["ops"].append({"op": "set_number", **meta, "reg": reg, "write": await wr(reg, vals4, length, await_s=0.4)})
-            elif op == "sw":
-                reg, vals4, length, meta = build_switch_write(proto, key, val)
-                results["ops"].append({"op": "set_switch", **meta, "reg": reg, "write": await wr(reg, vals4, length, await_s=0.4)})
-            elif op == "soc_reset":
-                if args.max_cell_v is None:
-                    raise SystemExit("--soc-reset requires --max-cell-v (for now)")
-                ovp_trigger = round(args.max_cell_v - 0.05, 3)
-                ovpr_trigger = round(args.max_cell_v - 0.10, 3)
-                r_ovpr, v_ovpr, l_ovpr, _ = build_number_write(proto, "cell_ovpr_v", ovpr_trigger)
-                r_ovp, v_ovp, l_ovp, _ = build_number_write(proto, "cell_ovp_v", ovp_trigger)
-                w1 = await wr(r_ovpr, v_ovpr, l_ovpr, await_s=0.5)
-                w2 = await wr(r_ovp, v_ovp, l_ovp, await_s=0.5)
-                await asyncio.sleep(5)
-                results["ops"].append({"op": "soc_reset", "max_cell_v": args.max_cell_v, "ovpr_trigger": ovpr_trigger, "ovp_trigger": ovp_trigger, "writes": [w1, w2]})
-
-    print(json.dumps(results, ensure_ascii=False))
+            # per-link request, works without root; --fast-interval sets the adapter defaults
+            await request_fast_connection(client)
+            results["proto"] = proto
+            results["ops"] = await run_ops(client, ops, proto, args)
+        finally:
+            await client.disconnect()
+    finally:
+        if saved is not None:
+            set_debugfs_conn_interval(args.adapter, *saved)
 
 
 if __name__ == "__main__":
+    # lower per-callback overhead for the back-to-back register writes; bleak's dbus-fast
+    # bus only needs add_reader/add_writer, which uvloop provides
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
     asyncio.run(main())
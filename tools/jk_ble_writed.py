@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+JK-BMS BLE write daemon.
+
+Keeps the BLE connection open between jk_ble_write.py calls, so a batch of invocations
+pays connect + service discovery once. jk_ble_write.py sends its planned ops over a Unix
+socket (default /run/jk-ble-write/jk_ble_write.sock, see systemd/jk-ble-writed.service) and
+prints the result as before. The connection is closed after --idle-s (default 30 s)
+without a request, after any error, and when a request names another address/adapter.
+
+Protocol: one JSON line per socket connection, answered by one JSON line:
+  -> {"address": "..", "adapter": "hci0", "timeout": 20, "proto": "jk02_24s",
+      "ops": [["num", "cell_ovp_v", 3.6], ...], "settle_ms": 400, "pipeline_depth": 4,
+      "max_cell_v": null, "coalesce": false}
+  <- {"ops": [...]}  or  {"error": "..."}
+
+WARNING:
+- While the daemon holds the connection no other client (e.g. the MQTT gateway) can
+  connect to that BMS; keep --idle-s short.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+from types import SimpleNamespace
+from typing import Any, Dict, Optional
+
+from bleak import BleakClient
+
+import jk_ble_write
+from _ble_cache import request_fast_connection, with_ble_lock
+
+
+class Writer:
+    def __init__(self, idle_s: float):
+        self.idle_s = idle_s
+        self._lock = asyncio.Lock()
+        self._client: Optional[BleakClient] = None
+        self._key: Optional[tuple] = None
+        self._idle: Optional[asyncio.TimerHandle] = None
+        self._idle_task: Optional[asyncio.Task] = None
+        self._last_used = 0.0
+
+    async def _get_client(self, address: str, adapter: Optional[str], timeout: float) -> BleakClient:
+        key = (address.strip().upper(), adapter or None)
+        if self._client is not None and (self._key != key or not self._client.is_connected):
+            await self.close()
+        if self._client is None:
+            client = BleakClient(address, timeout=timeout, adapter=adapter)
+            # same cross-process lock as the gateways: no concurrent connects on the adapter
+            await with_ble_lock(client.connect, timeout_s=max(30.0, timeout + 10.0))
+            await request_fast_connection(client)
+            self._client, self._key = client, key
+        return self._client
+
+    async def close(self) -> None:
+        client, self._client, self._key = self._client, None, None
+        if client is None:
+            return
+        try:
+            await client.disconnect()
+        except Exception:
+            pass
+
+    async def _idle_close(self) -> None:
+        async with self._lock:
+            # a request may have run while we waited for the lock
+            if asyncio.get_running_loop().time() - self._last_used >= self.idle_s:
+                await self.close()
+
+    def _arm_idle(self) -> None:
+        if self._idle is not None:
+            self._idle.cancel()
+        self._idle = asyncio.get_running_loop().call_later(self.idle_s, self._start_idle_close)
+
+    def _start_idle_close(self) -> None:
+        # keep a reference, the loop only holds tasks weakly
+        self._idle_task = asyncio.ensure_future(self._idle_close())
+
+    async def handle(self, req: Dict[str, Any]) -> Dict[str, Any]:
+        proto = str(req.get("proto") or jk_ble_write.PROTO_JK02_24S)
+        if proto not in (jk_ble_write.PROTO_JK02_24S, jk_ble_write.PROTO_JK02_32S):
+            return {"error": f"invalid proto {proto!r}"}
+        if not req.get("address") or not isinstance(req.get("ops"), list):
+            return {"error": "address and ops are required"}
+        args = SimpleNamespace(
+            settle_ms=req.get("settle_ms", 400.0),
+            pipeline_depth=req.get("pipeline_depth", 4),
+            max_cell_v=req.get("max_cell_v"),
+            coalesce=bool(req.get("coalesce")),
+        )
+        try:
+            # a bad op fails here, before connecting or touching a healthy link
+            jk_ble_write.plan_ops(proto, req["ops"], args)
+            timeout = float(req.get("timeout") or 20.0)
+            bound = jk_ble_write.request_timeout_s(timeout, args.settle_ms, req["ops"])
+        except Exception as e:
+            return {"error": f"{type(e).__name__}: {e}"}
+
+        async def apply() -> Dict[str, Any]:
+            client = await self._get_client(str(req["address"]), req.get("adapter"), timeout)
+            return {"ops": await jk_ble_write.run_ops(client, req["ops"], proto, args)}
+
+        async with self._lock:
+            try:
+                # a hung WriteValue must not hold the lock (and the link) for later requests
+                return await asyncio.wait_for(apply(), timeout=bound)
+            except asyncio.TimeoutError as e:
+                # wait_for's own timeout has no message, a BLE lock timeout from inside has one
+                await self.close()
+                return {"error": f"TimeoutError: {str(e) or f'no result within {bound:g} s'}"}
+            except Exception as e:
+                # link state is unknown after a failed write: reconnect on the next request
+                await self.close()
+                return {"error": f"{type(e).__name__}: {e}"}
+            finally:
+                self._last_used = asyncio.get_running_loop().time()
+                self._arm_idle()
+
+
+async def serve(sock_path: str, idle_s: float) -> None:
+    w = Writer(idle_s)
+
+    async def on_conn(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            line = await reader.readline()
+            try:
+                req = json.loads(line)
+            except Exception:
+                req = None
+            resp = await w.handle(req) if isinstance(req, dict) else {"error": "invalid request"}
+            writer.write(jk_ble_write._dumps(resp) + b"\n")
+            await writer.drain()
+        except Exception as e:
+            print(f"request failed: {type(e).__name__}: {e}", file=sys.stderr)
+        finally:
+            writer.close()
+
+    try:
+        os.unlink(sock_path)
+    except FileNotFoundError:
+        pass
+    server = await asyncio.start_unix_server(on_conn, path=sock_path)
+    os.chmod(sock_path, 0o660)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        server.close()
+        await server.wait_closed()
+        await w.close()
+        try:
+            os.unlink(sock_path)
+        except FileNotFoundError:
+            pass
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--socket", default=jk_ble_write.SOCKET_PATH)
+    ap.add_argument("--idle-s", type=float, default=30.0, help="Disconnect after this many seconds without a request")
+    args = ap.parse_args()
+
+    if jk_ble_write.uvloop is not None:
+        asyncio.set_event_loop_policy(jk_ble_write.uvloop.EventLoopPolicy())
+    asyncio.run(serve(args.socket, max(1.0, args.idle_s)))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())